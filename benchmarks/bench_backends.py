@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""Bytes and decode time of a story listing, v3 xml against v5 json
+
+    python benchmarks/bench_backends.py [<number_of_stories>] [<repeat>]
+
+Builds the same generated stories as a v3 xml document, a v5 json document with every field, and
+a v5 json document limited to the fields list views ask for (pivotal.LIST_FIELDS).  Reports the
+size of each, raw and gzipped as sent over the wire, and the time each backend takes to decode it
+into Story objects.
+"""
+
+# Core Imports
+import os
+import sys
+import json
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pivotal_tools.pivotal import XmlBackend, LIST_FIELDS, ALL_FIELDS
+from pivotal_tools.json_api import JsonBackend
+from fixtures import generate_stories_document, story_json
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def gzipped_size(body):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return len(compressor.compress(body) + compressor.flush())
+
+
+def main():
+    number_of_stories = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    xml_backend = XmlBackend()
+    json_backend = JsonBackend()
+
+    xml_body = generate_stories_document(number_of_stories)
+    stories = xml_backend.parse_stories(xml_body)
+    documents = [
+        ('v3 xml', xml_backend, xml_body),
+        ('v5 json, all fields', json_backend, json.dumps([story_json(story, ALL_FIELDS) for story in stories])),
+        ('v5 json, list fields', json_backend, json.dumps([story_json(story, LIST_FIELDS) for story in stories])),
+    ]
+
+    print '{} stories'.format(number_of_stories)
+    print '{:22s} {:>10s} {:>10s} {:>10s} {:>14s}'.format('', 'bytes', 'gzipped', 'decode', 'stories/s')
+    for name, backend, body in documents:
+        seconds = best_of(repeat, lambda: backend.parse_stories(body))
+        print '{:22s} {:10d} {:10d} {:8.1f}ms {:14,.0f}'.format(name, len(body), gzipped_size(body), seconds * 1000,
+                                                               number_of_stories / seconds)
+
+
+if __name__ == '__main__':
+    main()
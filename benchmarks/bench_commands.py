@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""Wall time, requests and bytes of the command line against a local fake Tracker
+
+    python benchmarks/bench_commands.py [<stories_per_project>] [<latency_ms>] [<projects>] [<api_version>]
+
+Starts benchmarks/fake_tracker.py with generated projects and runs each command as a subprocess
+pointed at it, first with an empty cache directory (cold) and then again with the cache the cold
+run left behind (warm).  Then times the lookups that fan out over every project, in process, for a
+story in the last of <projects> projects (default 40).  Those run MAX_WORKERS requests at a time, so
+they should take about <projects> / MAX_WORKERS round trips; a lookup taking more than twice that is
+flagged, as it means requests are being serialised (by the rate limit, or a lookup that goes project
+by project).
+
+Every request is delayed by the latency (default 20ms), so the request counts show up in the
+timings the way they would against the real server.  Pass an api version of 5 to run the commands
+against the json API instead of v3.
+"""
+
+# Core Imports
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+CLI = os.path.join(ROOT, 'pivotal_tools', 'cli.py')
+
+sys.path.insert(0, ROOT)
+
+from fake_tracker import FakeTracker
+
+# name, cli arguments, stdin
+COMMANDS = [
+    ('changelog', ['changelog', '--project-index=1'], ''),
+    ('scrum', ['scrum', '--project-index=1'], ''),
+    ('show stories', ['show', 'stories', '--project-index=1', '--number=50'], ''),
+    ('show story', ['show', 'story', '{story_id}'], ''),
+    ('poker setup', ['poker', '--project-index=1'], 'q\n'),
+]
+
+
+def run_command(tracker, api_version, cache_dir, arguments, stdin):
+    """runs the cli once, returns (seconds, requests, bytes)"""
+    env = dict(os.environ, PIVOTAL_API_VERSION=api_version, PIVOTAL_TOKEN='benchmark', PIVOTAL_CACHE_DIR=cache_dir,
+               PIVOTAL_API_URL=tracker.v5_api_url if api_version == '5' else tracker.api_url,
+               TERM=os.getenv('TERM', 'dumb'))
+    tracker.reset_stats()
+    with open(os.devnull, 'w') as devnull:
+        start = time.time()
+        process = subprocess.Popen([sys.executable, CLI] + arguments, env=env, stdin=subprocess.PIPE,
+                                   stdout=devnull, stderr=devnull)
+        process.communicate(stdin)
+        seconds = time.time() - start
+    if process.returncode != 0:
+        print '  {} exited with {}'.format(' '.join(arguments), process.returncode)
+    stats = tracker.stats()
+    return seconds, stats['requests'], stats['bytes']
+
+
+def bench_commands(stories, latency, api_version):
+    tracker = FakeTracker(projects=3, stories=stories, latency=latency)
+    tracker.start()
+    story_id = tracker.projects[-1].order[0]
+
+    print '{} stories in each of {} projects, {:.0f}ms latency, v{} api'.format(stories, len(tracker.projects),
+                                                                              latency * 1000, api_version)
+    print '{:14s} {:>10s} {:>6s} {:>10s}   {:>10s} {:>6s} {:>10s}'.format('', 'cold', 'reqs', 'bytes',
+                                                                         'warm', 'reqs', 'bytes')
+    try:
+        for name, arguments, stdin in COMMANDS:
+            arguments = [argument.format(story_id=story_id) for argument in arguments]
+            cache_dir = tempfile.mkdtemp(prefix='pivotal_bench_')
+            try:
+                cold = run_command(tracker, api_version, cache_dir, arguments, stdin)
+                warm = run_command(tracker, api_version, cache_dir, arguments, stdin)
+            finally:
+                shutil.rmtree(cache_dir)
+            print '{:14s} {:8.0f}ms {:6d} {:10d}   {:8.0f}ms {:6d} {:10d}'.format(
+                name, cold[0] * 1000, cold[1], cold[2], warm[0] * 1000, warm[1], warm[2])
+    finally:
+        tracker.stop()
+
+
+def bench_fan_out(projects, latency):
+    """lookups of a story in the last project, that have to search every project, in process"""
+    tracker = FakeTracker(projects=projects, stories=5, latency=latency)
+    tracker.start()
+    cache_dir = tempfile.mkdtemp(prefix='pivotal_bench_')
+    from pivotal_tools import pivotal, cache
+    story_id = tracker.projects[-1].order[0]
+    lookups = [
+        ('find_project_for_story', lambda: pivotal.find_project_for_story(story_id).project_id),
+        ('Story.find_many', lambda: pivotal.Story.find_many([story_id])[story_id][0].project_id),
+    ]
+    expected = -(-projects // pivotal.MAX_WORKERS)
+    try:
+        pivotal.API_URL = tracker.api_url
+        pivotal.TOKEN = 'benchmark'
+        cache.CACHE_DIR = cache_dir
+        pivotal.Project.all()
+
+        print
+        print 'Lookups across {} projects, {} requests at a time: about {} round trips expected'.format(
+            projects, pivotal.MAX_WORKERS, expected)
+        for name, lookup in lookups:
+            # Forget where the story was seen, so the lookup searches every project
+            pivotal.forget_story(story_id)
+            tracker.reset_stats()
+            start = time.time()
+            project_id = lookup()
+            seconds = time.time() - start
+            stats = tracker.stats()
+            assert project_id == tracker.projects[-1].project_id
+
+            round_trips = seconds / latency if latency else 0
+            print '{:24s} {:8.0f}ms {:6d} requests {:8d} bytes {:6.1f} round trips{}'.format(
+                name, seconds * 1000, stats['requests'], stats['bytes'], round_trips,
+                '  SERIALISED' if round_trips > 2 * expected else '')
+    finally:
+        # Close the kept alive connections, so the server's handler threads end before the interpreter does
+        pivotal.get_session().close()
+        shutil.rmtree(cache_dir)
+        tracker.stop()
+
+
+def main():
+    stories = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.02
+    projects = int(sys.argv[3]) if len(sys.argv) > 3 else 40
+    api_version = sys.argv[4] if len(sys.argv) > 4 else '3'
+
+    bench_commands(stories, latency, api_version)
+    bench_fan_out(projects, latency)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""Parse throughput of Story.from_node, in stories per second
+
+    python benchmarks/bench_parse.py [<number_of_stories>] [<repeat>]
+
+Reports the time to decode an already parsed tree (Story.from_node alone) and the time
+for the whole response (ET.fromstring + Story.from_node).
+"""
+
+# Core Imports
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pivotal_tools.pivotal import ET, Story
+from fixtures import generate_stories_document
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def main():
+    number_of_stories = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    document = generate_stories_document(number_of_stories)
+    root = ET.fromstring(document)
+
+    results = [
+        ('Story.from_node', best_of(repeat, lambda: [Story.from_node(node) for node in root])),
+        ('fromstring + from_node', best_of(repeat, lambda: [Story.from_node(node) for node in ET.fromstring(document)])),
+    ]
+
+    print '{} stories, {:.1f} KB, best of {}'.format(number_of_stories, len(document) / 1024.0, repeat)
+    for name, seconds in results:
+        print '{:24s} {:8.3f}s {:12,.0f} stories/s'.format(name, seconds, number_of_stories / seconds)
+
+
+if __name__ == '__main__':
+    main()
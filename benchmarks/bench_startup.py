@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""Startup time of the command line, guarded against a budget
+
+    python benchmarks/bench_startup.py [<budget_ms>] [<runs>]
+
+Times `cli.py --help` and a usage error against a bare interpreter, and exits non zero if either
+costs more than the budget (default 100ms) over the bare interpreter, or if importing the cli pulls
+in the modules that are meant to load only when a command needs them.
+"""
+
+# Core Imports
+import os
+import sys
+import time
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+CLI = os.path.join(ROOT, 'pivotal_tools', 'cli.py')
+
+# Modules that must not be imported just to parse the command line
+DEFERRED_MODULES = ['requests', 'dicttoxml', 'termcolor', 'webbrowser', 'multiprocessing.pool', 'sqlite3', 'importer', 'exporter', 'json_api',
+                    'daemon']
+
+
+def median_run_time(command, runs):
+    timings = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(runs):
+            start = time.time()
+            subprocess.call(command, stdout=devnull, stderr=devnull)
+            timings.append(time.time() - start)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def eagerly_imported():
+    """returns the deferred modules that importing cli loads anyway"""
+    check = ('import sys; sys.path.insert(0, {!r}); import cli; '
+             'print(" ".join(m for m in {!r} if m in sys.modules))').format(os.path.dirname(CLI), DEFERRED_MODULES)
+    return subprocess.check_output([sys.executable, '-c', check]).split()
+
+
+def main():
+    budget = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.1
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 11
+
+    bare = median_run_time([sys.executable, '-c', 'pass'], runs)
+    results = [
+        ('--help', median_run_time([sys.executable, CLI, '--help'], runs)),
+        ('usage error', median_run_time([sys.executable, CLI, 'no-such-command'], runs)),
+    ]
+
+    failed = False
+    print '{:14s} {:7.1f}ms'.format('bare python', bare * 1000)
+    for name, seconds in results:
+        overhead = seconds - bare
+        over_budget = overhead > budget
+        failed = failed or over_budget
+        print '{:14s} {:7.1f}ms  (+{:.1f}ms{})'.format(name, seconds * 1000, overhead * 1000,
+                                                     ', OVER BUDGET' if over_budget else '')
+
+    eager = eagerly_imported()
+    if eager:
+        failed = True
+        print 'Imported at startup, but should be deferred: {}'.format(', '.join(eager))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
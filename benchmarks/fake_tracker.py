@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+"""A local stand-in for the Tracker endpoints pivotal.py uses, serving generated projects
+
+    python benchmarks/fake_tracker.py [<projects>] [<stories_per_project>] [<latency_ms>] [<port>]
+
+Point the tools at it with PIVOTAL_API_URL=http://127.0.0.1:<port>/services/v3, or at the json
+version of the same endpoints with PIVOTAL_API_URL=http://127.0.0.1:<port>/services/v5 and
+PIVOTAL_API_VERSION=5 (which honours the fields parameter).  Serves:
+
+    GET  /projects
+    GET  /projects/<id>
+    GET  /projects/<id>/stories?filter=&limit=&offset=
+    GET  /projects/<id>/stories/<story id>
+    PUT  /projects/<id>/stories/<story id>?story[estimate]=&story[current_state]=
+    POST /projects/<id>/stories
+
+Filters are evaluated with filters.py, accepted stories are left out unless the filter asks for
+includedone:true or names a state, as Tracker does.  Responses carry an ETag and are gzipped when
+asked, and every request is delayed by the configured latency.  The server counts the requests it
+answers and the bytes it sends, see FakeTracker.stats().
+"""
+
+# Core Imports
+import os
+import re
+import sys
+import gzip
+import time
+import random
+import json
+import hashlib
+import socket
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+from cStringIO import StringIO
+from xml.sax.saxutils import escape
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pivotal_tools import filters
+from pivotal_tools.pivotal import Story, ALL_FIELDS
+from pivotal_tools.json_api import API_FIELDS
+import fixtures
+
+# The format served below each api root
+API_PATHS = {'/services/v3': 'xml', '/services/v5': 'json'}
+
+PROJECT_PATH = re.compile(r'^/projects/(\d+)$')
+STORY_PATH = re.compile(r'^/projects/(\d+)/stories(?:/(\d+))?$')
+
+# Seconds stop() waits for requests still being answered
+STOP_TIMEOUT = 5
+
+# Filter terms Tracker understands that the fake ignores
+IGNORED_FILTER_TERM = re.compile(r'\b(?:modified_since|includedone):\S+')
+
+
+class FakeProject(object):
+    """a generated project, its stories are kept as xml fragments next to the Story they decode to"""
+
+    def __init__(self, project_id, number_of_stories, rng):
+        self.project_id = str(project_id)
+        self.name = 'Project {}'.format(project_id)
+        self.order = []
+        self.stories = {}
+        self.lock = threading.Lock()
+        for n in range(number_of_stories):
+            self.add(fixtures.story_xml(project_id, project_id * 1000000 + n, rng))
+
+    def add(self, xml):
+        story = Story.from_node(ET.fromstring(xml))
+        with self.lock:
+            if story.story_id not in self.stories:
+                self.order.append(story.story_id)
+            self.stories[story.story_id] = (story, xml)
+        return xml
+
+    def update(self, story_id, estimate=None, state=None):
+        """applies a PUT to a story, returns its new xml, or None if there is no such story"""
+        with self.lock:
+            if story_id not in self.stories:
+                return None
+            xml = self.stories[story_id][1]
+        if estimate is not None:
+            if '<estimate' in xml:
+                xml = re.sub(r'<estimate type="integer">[^<]*</estimate>',
+                             '<estimate type="integer">{}</estimate>'.format(estimate), xml)
+            else:
+                xml = xml.replace('<current_state>', '<estimate type="integer">{}</estimate><current_state>'.format(estimate))
+        if state is not None:
+            xml = re.sub(r'<current_state>[^<]*</current_state>', '<current_state>{}</current_state>'.format(state), xml)
+        return self.add(xml)
+
+    def query(self, filter_string):
+        """returns the (story, xml) entries of the stories matching a filter, in priority order"""
+        with self.lock:
+            stories = [self.stories[story_id][0] for story_id in self.order]
+            entries = dict(self.stories)
+
+        include_done = 'includedone:true' in filter_string
+        filter_string = IGNORED_FILTER_TERM.sub('', filter_string)
+        try:
+            if not include_done and filters.states(filter_string) is None:
+                stories = [story for story in stories if story.state != 'accepted']
+            matches = filters.StorySet(stories).query(filter_string)
+        except filters.FilterSyntaxError:
+            matches = stories
+        return [entries[story.story_id] for story in matches]
+
+
+class FakeTracker(object):
+    """Serves generated projects on a local port, in a background thread.
+
+        tracker = FakeTracker(projects=3, stories=200, latency=0.05)
+        api_url = tracker.start()
+        ...
+        print tracker.stats()
+        tracker.stop()
+    """
+
+    def __init__(self, projects=1, stories=100, latency=0.0, seed=0, port=0):
+        rng = random.Random(seed)
+        self.projects = [FakeProject(project_id, stories, rng) for project_id in range(1, projects + 1)]
+        self.projects_by_id = dict((project.project_id, project) for project in self.projects)
+        self.latency = latency
+        self.port = port
+        self.server = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.next_story_id = (projects + 1) * 1000000
+        self.reset_stats()
+
+    def start(self):
+        """starts serving, returns the api url to point PIVOTAL_API_URL at"""
+        self.server = _ThreadedServer(('127.0.0.1', self.port), _Handler)
+        self.server.tracker = self
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.api_url
+
+    @property
+    def api_url(self):
+        return 'http://127.0.0.1:{}/services/v3'.format(self.port)
+
+    @property
+    def v5_api_url(self):
+        return 'http://127.0.0.1:{}/services/v5'.format(self.port)
+
+    def stop(self):
+        """Stops serving, and waits for the threads answering requests, so none outlive the interpreter.
+        Connections clients still keep alive are closed, rather than waited on for another request
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.server.close_requests()
+        self.server.join_handlers(STOP_TIMEOUT)
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests = 0
+            self.bytes_sent = 0
+            self.requests_by_method = {}
+
+    def stats(self):
+        """returns a dict of the requests answered and body bytes sent since the last reset"""
+        with self.lock:
+            return {'requests': self.requests,
+                    'bytes': self.bytes_sent,
+                    'by_method': dict(self.requests_by_method)}
+
+    def count(self, method, body_size):
+        with self.lock:
+            self.requests += 1
+            self.bytes_sent += body_size
+            self.requests_by_method[method] = self.requests_by_method.get(method, 0) + 1
+
+    def new_story_id(self):
+        with self.lock:
+            self.next_story_id += 1
+            return self.next_story_id
+
+
+class _ThreadedServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def process_request(self, request, client_address):
+        """ThreadingMixIn.process_request, keeping the thread and its socket so stop() can end both"""
+        thread = threading.Thread(target=self.process_request_thread, args=(request, client_address))
+        thread.daemon = self.daemon_threads
+        self.handlers = [(handler, sock) for handler, sock in getattr(self, 'handlers', [])
+                         if handler.is_alive()] + [(thread, request)]
+        thread.start()
+
+    def close_requests(self):
+        """shuts the request sockets down, so a handler waiting for a kept alive connection's next request
+        sees the connection close and returns
+        """
+        for handler, sock in getattr(self, 'handlers', []):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                # Already closed by the handler
+                pass
+
+    def join_handlers(self, timeout):
+        deadline = time.time() + timeout
+        for handler, sock in getattr(self, 'handlers', []):
+            handler.join(max(0, deadline - time.time()))
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # The status line, headers and body are written separately.  With Nagle's algorithm on, a kept alive
+    # connection then stalls each response for the client's delayed ack, about 40ms
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def tracker(self):
+        return self.server.tracker
+
+    def do_GET(self):
+        path, query = self._route()
+        if path is None:
+            return
+        if path == '/projects':
+            if self.format == 'json':
+                return self._send(200, json.dumps([_project_json(project) for project in self.tracker.projects]))
+            return self._send(200, fixtures.projects_xml([fixtures.project_xml(project.project_id, project.name)
+                                                          for project in self.tracker.projects]))
+
+        match = PROJECT_PATH.match(path)
+        if match:
+            project = self.tracker.projects_by_id.get(match.group(1))
+            if project is None:
+                return self._send(404, '')
+            if self.format == 'json':
+                return self._send(200, json.dumps(_project_json(project)))
+            return self._send(200, fixtures.project_xml(project.project_id, project.name))
+
+        match = STORY_PATH.match(path)
+        project = match and self.tracker.projects_by_id.get(match.group(1))
+        if project is None:
+            return self._send(404, '')
+
+        if match.group(2):
+            with project.lock:
+                entry = project.stories.get(match.group(2))
+            return self._send(200, self._story_body(entry, query)) if entry else self._send(404, '')
+
+        entries = project.query(query.get('filter', [''])[0])
+        offset = int(query.get('offset', [0])[0])
+        limit = query.get('limit')
+        entries = entries[offset:offset + int(limit[0]) if limit else None]
+        if self.format == 'json':
+            fields = _requested_fields(query)
+            self._send(200, json.dumps([fixtures.story_json(story, fields) for story, xml in entries]))
+        else:
+            self._send(200, fixtures.stories_xml([xml for story, xml in entries]))
+
+    def do_PUT(self):
+        path, query = self._route()
+        if path is None:
+            return
+        body = self._read_body()
+        match = STORY_PATH.match(path)
+        project = match and match.group(2) and self.tracker.projects_by_id.get(match.group(1))
+        if not project:
+            return self._send(404, '')
+
+        if self.format == 'json':
+            changes = json.loads(body or '{}')
+        else:
+            changes = dict((key[len('story['):-1], values[0]) for key, values in query.iteritems())
+        xml = project.update(match.group(2), estimate=changes.get('estimate'), state=changes.get('current_state'))
+        if xml is None:
+            return self._send(404, '')
+        with project.lock:
+            entry = project.stories[match.group(2)]
+        self._send(200, self._story_body(entry, {}))
+
+    def do_POST(self):
+        path, query = self._route()
+        if path is None:
+            return
+        body = self._read_body()
+        match = STORY_PATH.match(path)
+        project = match and not match.group(2) and self.tracker.projects_by_id.get(match.group(1))
+        if not project:
+            return self._send(404, '')
+
+        try:
+            if self.format == 'json':
+                name = json.loads(body).get('name')
+            else:
+                name = ET.fromstring('<story>{}</story>'.format(body)).findtext('.//name')
+        except (ValueError, SyntaxError):
+            return self._send(422, '')
+        story_id = self.tracker.new_story_id()
+        xml = fixtures.story_xml(project.project_id, story_id, random.Random(story_id))
+        xml = project.add(xml.replace('<name>', '<name>{}'.format(escape(name or '')), 1))
+        with project.lock:
+            entry = project.stories[str(story_id)]
+        self._send(200, self._story_body(entry, {}))
+
+    def _story_body(self, entry, query):
+        story, xml = entry
+        if self.format == 'json':
+            return json.dumps(fixtures.story_json(story, _requested_fields(query)))
+        return xml
+
+    def _route(self):
+        """waits out the latency, and splits the request into a path below the api root and its query"""
+        if self.tracker.latency:
+            time.sleep(self.tracker.latency)
+        url = urlparse.urlsplit(self.path)
+        for api_path, format in API_PATHS.iteritems():
+            if url.path.startswith(api_path):
+                self.format = format
+                return url.path[len(api_path):] or '/', urlparse.parse_qs(url.query)
+        self.format = 'xml'
+        self._send(404, '')
+        return None, None
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else ''
+
+    def _send(self, status, body):
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        if status == 200 and self.command == 'GET' and self.headers.get('If-None-Match') == etag:
+            status, body = 304, ''
+
+        encoding = None
+        if body and 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+            buf = StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6) as gzipped:
+                gzipped.write(body)
+            body = buf.getvalue()
+            encoding = 'gzip'
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/{}; charset=utf-8'.format(self.format))
+        self.send_header('Content-Length', str(len(body)))
+        if status in (200, 304):
+            self.send_header('ETag', etag)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        self.wfile.write(body)
+        self.tracker.count(self.command, len(body))
+
+
+def _project_json(project):
+    return {'id': int(project.project_id), 'name': project.name, 'point_scale': '0,1,2,3'}
+
+
+def _requested_fields(query):
+    """the Story attributes asked for by a v5 fields parameter, every attribute if there is none"""
+    if 'fields' not in query:
+        return ALL_FIELDS
+    requested = set()
+    depth = 0
+    field = ''
+    for character in query['fields'][0] + ',':
+        if character == ',' and depth == 0:
+            requested.add(field)
+            field = ''
+            continue
+        depth += {'(': 1, ')': -1}.get(character, 0)
+        field += character
+    return [attribute for attribute, api_field in API_FIELDS.iteritems() if api_field in requested]
+
+
+def main():
+    projects = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    stories = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    latency = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.0
+    port = int(sys.argv[4]) if len(sys.argv) > 4 else 8765
+
+    tracker = FakeTracker(projects, stories, latency, port=port)
+    print 'Serving {} projects of {} stories at {}'.format(projects, stories, tracker.start())
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        tracker.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Generated Tracker v3 documents, shared by the benchmarks"""
+
+# Core Imports
+import random
+from xml.sax.saxutils import escape
+
+STORY_TYPES = ['feature', 'bug', 'chore']
+STATES = ['unscheduled', 'unstarted', 'started', 'finished', 'delivered', 'accepted', 'rejected']
+OWNERS = ['Ada Lovelace', 'Grace Hopper', 'Alan Turing', 'Edsger Dijkstra', '']
+LABELS = ['', 'api', 'ui', 'billing', 'api,billing']
+
+
+def story_xml(project_id, story_id, rng=random):
+    """returns the xml for a single story, with a few notes and tasks"""
+    story_type = rng.choice(STORY_TYPES)
+    estimate = rng.choice([-1, 0, 1, 2, 3]) if story_type == 'feature' else None
+    notes = ''.join('<note><id type="integer">{0}{1}</id><text>{2}</text><author>{3}</author>'
+                    '<noted_at type="datetime">2013/08/15 12:00:00 UTC</noted_at></note>'.format(
+                        story_id, n, escape('Note number {} on story {}'.format(n, story_id)), rng.choice(OWNERS))
+                    for n in range(rng.randint(0, 3)))
+    tasks = ''.join('<task><id type="integer">{0}{1}</id><description>Task {1}</description>'
+                    '<position>{1}</position><complete>{2}</complete></task>'.format(
+                        story_id, n, rng.choice(['true', 'false']))
+                    for n in range(rng.randint(0, 3)))
+    return ('<story>'
+            '<id type="integer">{story_id}</id>'
+            '<project_id type="integer">{project_id}</project_id>'
+            '<story_type>{story_type}</story_type>'
+            '<url>https://www.pivotaltracker.com/story/show/{story_id}</url>'
+            '{estimate}'
+            '<current_state>{state}</current_state>'
+            '<description>{description}</description>'
+            '<name>{name}</name>'
+            '<requested_by>Ada Lovelace</requested_by>'
+            '<owned_by>{owner}</owned_by>'
+            '<created_at type="datetime">2013/08/01 12:00:00 UTC</created_at>'
+            '<updated_at type="datetime">2013/08/15 12:00:00 UTC</updated_at>'
+            '<labels>{labels}</labels>'
+            '<notes type="array">{notes}</notes>'
+            '<tasks type="array">{tasks}</tasks>'
+            '</story>').format(story_id=story_id,
+                               project_id=project_id,
+                               story_type=story_type,
+                               estimate='<estimate type="integer">{}</estimate>'.format(estimate) if estimate is not None else '',
+                               state=rng.choice(STATES),
+                               description=escape('A generated description for story {}. '.format(story_id) * 4),
+                               name=escape('Generated story {}'.format(story_id)),
+                               owner=rng.choice(OWNERS),
+                               labels=rng.choice(LABELS),
+                               notes=notes,
+                               tasks=tasks)
+
+
+def stories_xml(stories):
+    """wraps story xml fragments in a stories document"""
+    return '<?xml version="1.0" encoding="UTF-8"?><stories type="array" count="{0}" total="{0}">{1}</stories>'.format(
+        len(stories), ''.join(stories))
+
+
+def project_xml(project_id, name):
+    return ('<project><id>{}</id><name>{}</name><iteration_length type="integer">1</iteration_length>'
+            '<point_scale>0,1,2,3</point_scale></project>').format(project_id, escape(name))
+
+
+def projects_xml(projects):
+    return '<?xml version="1.0" encoding="UTF-8"?><projects type="array">{}</projects>'.format(''.join(projects))
+
+
+def generate_stories_document(number_of_stories, project_id=1, seed=0):
+    """returns a stories document with the given number of stories"""
+    rng = random.Random(seed)
+    return stories_xml([story_xml(project_id, project_id * 1000000 + n, rng) for n in range(number_of_stories)])
+
+
+def story_json(story, fields):
+    """returns the v5 json object Tracker would send for a Story, limited to the given Story attributes"""
+    data = {'kind': 'story', 'id': int(story.story_id)}
+    if 'project_id' in fields:
+        data['project_id'] = int(story.project_id)
+    if 'name' in fields:
+        data['name'] = story.name
+    if 'description' in fields:
+        data['description'] = story.description
+    if 'owned_by' in fields:
+        data['owners'] = [{'kind': 'person', 'name': story.owned_by}] if story.owned_by else []
+    if 'story_type' in fields:
+        data['story_type'] = story.story_type
+    if 'estimate' in fields and story.estimate not in (None, -1):
+        # Tracker leaves the estimate out of unestimated features
+        data['estimate'] = story.estimate
+    if 'state' in fields:
+        data['current_state'] = story.state
+    if 'url' in fields:
+        data['url'] = story.url
+    if 'labels' in fields:
+        data['labels'] = [{'kind': 'label', 'name': label} for label in story.labels.split(',') if label]
+    if 'notes' in fields:
+        data['comments'] = [{'kind': 'comment', 'id': int(note.note_id), 'text': note.text,
+                             'person': {'kind': 'person', 'name': note.author}, 'file_attachments': []}
+                            for note in story.notes]
+    if 'tasks' in fields:
+        data['tasks'] = [{'kind': 'task', 'id': int(task.task_id), 'description': task.description,
+                          'complete': task.complete}
+                         for task in story.tasks]
+    return data
@@ -0,0 +1,129 @@
+# Core Imports
+import os
+import json
+import errno
+import time
+import hashlib
+import tempfile
+
+CACHE_DIR = os.getenv('PIVOTAL_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'pivotal_tools'))
+
+
+def cache_path(name):
+    """returns the full path of a file in the cache directory"""
+    return os.path.join(CACHE_DIR, name)
+
+
+def read_json(name, default=None):
+    """reads a json document from the cache, returns default if it is missing or unreadable"""
+    try:
+        with open(cache_path(name)) as cache_file:
+            return json.load(cache_file)
+    except (IOError, ValueError):
+        return default
+
+
+def write_json(name, data):
+    """writes a json document to the cache.  The file is replaced atomically so concurrent readers never see
+    a partial document.  Failing to write the cache is not an error, it just means the next run is slower
+    """
+    path = cache_path(name)
+    directory = os.path.dirname(path)
+    try:
+        _ensure_dir(directory)
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as tmp_file:
+            json.dump(data, tmp_file)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        pass
+
+
+def read_lines(name):
+    """reads a text file from the cache as a list of lines, empty if it is missing or unreadable"""
+    try:
+        with open(cache_path(name)) as cache_file:
+            return cache_file.readlines()
+    except IOError:
+        return []
+
+
+def append_lines(name, lines):
+    """appends lines to a text file in the cache, creating it if needed.  Failing to write is not an error"""
+    path = cache_path(name)
+    try:
+        _ensure_dir(os.path.dirname(path))
+        with open(path, 'a') as cache_file:
+            cache_file.write(''.join(lines))
+    except (IOError, OSError):
+        pass
+
+
+def write_lines(name, lines):
+    """replaces a text file in the cache with the given lines, atomically as write_json does"""
+    path = cache_path(name)
+    directory = os.path.dirname(path)
+    try:
+        _ensure_dir(directory)
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as tmp_file:
+            tmp_file.write(''.join(lines))
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        pass
+
+
+def touch(name):
+    """marks a file in the cache as just used, for prune"""
+    try:
+        os.utime(cache_path(name), None)
+    except OSError:
+        pass
+
+
+def prune(directory, max_bytes, max_age):
+    """Removes the json files of a cache directory not written or touched for max_age seconds, then the least
+    recently used until the rest add up to at most max_bytes
+    """
+    path = cache_path(directory)
+    try:
+        names = [name for name in os.listdir(path) if name.endswith('.json')]
+    except OSError:
+        return
+
+    entries = []
+    for name in names:
+        try:
+            stat = os.stat(os.path.join(path, name))
+        except OSError:
+            # Removed by another process
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name))
+
+    now = time.time()
+    total = 0
+    for used_at, size, name in sorted(entries, reverse=True):
+        total += size
+        if now - used_at > max_age or total > max_bytes:
+            remove(os.path.join(directory, name))
+
+
+def remove(name):
+    """removes a file from the cache, if present"""
+    try:
+        os.remove(cache_path(name))
+    except OSError:
+        pass
+
+
+def fingerprint(*parts):
+    """returns a stable hash of the given strings, used to key cache entries without storing tokens in the clear"""
+    return hashlib.sha1('\0'.join(part or '' for part in parts)).hexdigest()
+
+
+def _ensure_dir(directory):
+    try:
+        os.makedirs(directory)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
@@ -26,6 +26,9 @@ scrum
 ---------------
 Will list stories and bugs that team members are working on.  Grouped by team member
 
+changelog and scrum can report on several projects at once, given every project (all-projects option)
+or a comma separated list of project indexes
+
 poker (aka planning)
 ---------------
 Help to facilitate a planning poker session
@@ -34,99 +37,156 @@ create (feature|bug|chore)
 ---------------
 Create a story
 
+import <file>
+---------------
+Create a story for every row of a .csv, or line of a .jsonl (or .json) file.  An interrupted import picks up
+where it left off
+
+export [<file>]
+---------------
+Write every story of a project, with its notes, tasks, attachments and labels, as JSON lines or CSV (to stdout without a file)
+
+sync
+---------------
+Copy a project's stories into a local database.  show stories, scrum and changelog read from it when passed the cached option
+
+start|finish|deliver|accept|reject story
+---------------
+Change the state of one or more stories.  Pass - instead of story ids to read the ids from stdin
+
+daemon (start|stop|status)
+---------------
+Run a background process that keeps connections and recently read stories warm.  While it runs, show, scrum,
+changelog and the state changes are answered by it, in tens of milliseconds once their stories are in memory
+
 
 Usage:
-  pivotal_tools create (feature|bug|chore) <title> [<description>] [--project-index=<pi>]
-  pivotal_tools (start|finish|deliver|accept|reject) story <story_id> [--project-index=<pi>]
-  pivotal_tools show stories [--project-index=<pi>] [--for=<user_name>] [--number=<number_of_stories>]
-  pivotal_tools show story <story_id> [--project-index=<pi>]
-  pivotal_tools open <story_id> [--project-index=<pi>]
-  pivotal_tools changelog [--project-index=<pi>]
-  pivotal_tools scrum [--project-index=<pi>]
-  pivotal_tools (planning|poker) [--project-index=<pi>]
+  pivotal_tools create (feature|bug|chore) <title> [<description>] [--project-index=<pi>] [--refresh] [--profile]
+  pivotal_tools (start|finish|deliver|accept|reject) story <story_ids>... [--project-index=<pi>] [--refresh] [--profile]
+  pivotal_tools show stories [--project-index=<pi>] [--for=<user_name>] [--number=<number_of_stories>] [--refresh] [--cached] [--profile]
+  pivotal_tools show story <story_id> [--project-index=<pi>] [--refresh] [--profile]
+  pivotal_tools open <story_id> [--project-index=<pi>] [--refresh] [--profile]
+  pivotal_tools changelog [--project-index=<pi>] [--all-projects] [--refresh] [--cached] [--profile]
+  pivotal_tools scrum [--project-index=<pi>] [--all-projects] [--refresh] [--cached] [--profile]
+  pivotal_tools (planning|poker) [--project-index=<pi>] [--refresh] [--profile]
+  pivotal_tools import <file> [--project-index=<pi>] [--rate=<per_second>] [--refresh] [--profile]
+  pivotal_tools export [<file>] [--project-index=<pi>] [--format=<format>] [--refresh] [--profile]
+  pivotal_tools sync [--project-index=<pi>] [--full] [--refresh] [--profile]
+  pivotal_tools daemon (start|stop|status)
 
 Options:
   -h --help             Show this screen.
   --for=<user_name>     Username, or initials
   --project-index=<pi>  If you have multiple projects, this is the index that the project shows up in my prompt
                         This is useful if you do not want to be prompted, and then you can pipe the output
+                        changelog and scrum also take a list of indexes, such as 1,3,5
+  --all-projects        Report on every project at once (changelog and scrum)
+  --refresh             Ignore the cached project list and fetch it again
+  --rate=<per_second>   Stories created per second by import [default: 5]
+  --cached              Read stories from the local mirror kept by sync, instead of the network
+  --full                Sync every story, not just the ones changed since the last sync
+  --format=<format>     jsonl or csv, guessed from the file name if not given
+  --profile             Print where the time went (network, parsing, output) once the command finishes
 
 """
 
 #Core Imports
 import os
-import webbrowser
+import sys
+import time
+import errno
+import threading
+from datetime import datetime
 from itertools import islice
+from collections import OrderedDict
 
 
 #3rd Party Imports
+#requests, termcolor and webbrowser are imported where they are used, so --help and usage errors stay fast
 from docopt import docopt
-from termcolor import colored
 
-from pivotal import Project, Story, InvalidStateException
+from pivotal import Project, Story, MAX_PAGE_SIZE, transition_stories, concurrent_map, get_backend
+from pivotal import add_request_hook, remove_request_hook
+import render
+from pivotal import FINISHED_FEATURES_FILTER, FINISHED_BUGS_FILTER, KNOWN_ISSUES_FILTER, IN_PROGRESS_FILTER, OPEN_BUGS_FILTER
 
 
 ## Main Methods
 
+# State transition commands, and how they are reported
+TRANSITIONS = {'start': 'STARTED',
+               'finish': 'FINISHED',
+               'deliver': 'DELIVERED',
+               'accept': 'ACCEPTED',
+               'reject': 'REJECTED'}
+
 
 
-def generate_changelog(project):
-    """Generate a Changelog for the current project.  It is grouped into 3 sections:
+def generate_changelog(projects):
+    """Generate a Changelog for the given projects.  It is grouped into 3 sections:
     * New Features
     * Bugs Fixed
     * Known Issues
 
-    The new features section is grouped by label for easy comprehension
+    The new features section is grouped by label for easy comprehension.
+    Several projects are fetched at once, and their stories merged into one changelog
     """
 
-    title_string = 'Change Log {}'.format(project.name)
+    # One fetch per project covers every section, which are then filtered locally
+    sections = fetch_sections(projects, CHANGELOG_SNAPSHOT_FILTER, {'features': FINISHED_FEATURES_FILTER,
+                                                                    'bugs': FINISHED_BUGS_FILTER,
+                                                                    'known_issues': KNOWN_ISSUES_FILTER})
+    tags = project_tags(projects)
 
-    print
-    print bold(title_string)
-    print bold('=' * len(title_string))
-    print
+    title_string = 'Change Log {}'.format(', '.join(project.name for project in projects))
+
+    out = render.Renderer()
+    out.line()
+    out.bold(title_string)
+    out.bold('=' * len(title_string))
+    out.line()
 
-    print bold('New Features')
-    print bold('============')
+    out.bold('New Features')
+    out.bold('============')
 
-    finished_features = project.finished_features()
-    features_by_label = group_stories_by_label(finished_features)
+    features_by_label = group_stories_by_label(sections['features'])
 
     for label in features_by_label:
         if len(label) == 0:
             display_label = 'Other'
         else:
             display_label = label
-        print bold(display_label.title())
+        out.bold(display_label.title())
         for story in features_by_label[label]:
-            print '    * {:14s} {}'.format('[{}]'.format(story.story_id), story.name)
+            out.line(u'    * {:14s} {}{}'.format('[{}]'.format(story.story_id), tags.get(story.project_id, ''), story.name))
 
 
     def print_stories(stories):
         if len(stories) > 0:
             for story in stories:
-                story_string = ""
+                story_string = tags.get(story.project_id, '')
                 if story.labels is not None and len(story.labels) > 0:
                     story_string += "[{}] ".format(story.labels)
 
                 story_string += story.name
-                print '* {:14s} {}'.format('[{}]'.format(story.story_id), story_string)
+                out.line(u'* {:14s} {}'.format('[{}]'.format(story.story_id), story_string))
         else:
-            print 'None'
-            print
+            out.line('None')
+            out.line()
 
 
-    print
-    print bold('Bugs Fixed')
-    print bold('==========')
-    print_stories(project.finished_bugs())
+    out.line()
+    out.bold('Bugs Fixed')
+    out.bold('==========')
+    print_stories(sections['bugs'])
 
-    print
-    print bold('Known Issues')
-    print bold('==========')
-    print_stories(project.known_issues())
+    out.line()
+    out.bold('Known Issues')
+    out.bold('==========')
+    print_stories(sections['known_issues'])
 
-    print
+    out.line()
+    out.flush()
 
 
 def show_stories(project, arguments):
@@ -139,8 +199,6 @@ def show_stories(project, arguments):
     if arguments['--for'] is not None:
         search_string += " owner:{}".format(arguments['--for'])
 
-    stories = project.get_stories(search_string)
-
     number_of_stories = 20
     if arguments['--number'] is not None:
         number_of_stories = int(arguments['--number'])
@@ -149,17 +207,28 @@ def show_stories(project, arguments):
         print "Showing the top 20 stories, if you want to show more, specify number with the --number option"
         print
 
+    # Stream the stories a page at a time, so the first rows print while the rest are still downloading
+    # and we stop requesting pages once we have enough.  Rows are written in batches
+    page_size = max(1, min(number_of_stories, MAX_PAGE_SIZE))
+    stories = project.iter_stories(search_string, page_size=page_size)
 
-    if len(stories) == 0:
-        print "None"
-    else:
+    shown = 0
+    row = u'{:14s}{:4s}{:9s}{:13s}{:10s} {}'.format
+    with render.Renderer() as out:
         for story in islice(stories, number_of_stories):
-            print '{:14s}{:4s}{:9s}{:13s}{:10s} {}'.format('#{}'.format(story.story_id),
-                                                           initials(story.owned_by),
-                                                           story.story_type,
-                                                           story.state,
-                                                           estimate_visual(story.estimate),
-                                                           story.name)
+            out.line(row('#{}'.format(story.story_id),
+                         initials(story.owned_by),
+                         story.story_type,
+                         story.state,
+                         estimate_visual(story.estimate),
+                         story.name))
+            shown += 1
+            if shown % page_size == 0:
+                # The next story waits on a request for the next page, write this page's rows first
+                out.flush()
+
+        if shown == 0:
+            out.line("None")
 
 
 def show_story(story_id, arguments):
@@ -203,35 +272,42 @@ def show_story(story_id, arguments):
     print
 
 
-def scrum(project):
+def scrum(projects):
     """ CLI Visual Aid for running the daily SCRUM meeting.
-        Prints an list of stories that people are working on grouped by user
+        Prints an list of stories that people are working on grouped by user.
+        Several projects are fetched at once, and each person's stories merged across them
     """
 
-    stories = project.in_progress_stories()
-    stories_by_owner = group_stories_by_owner(stories)
+    sections = fetch_sections(projects, SCRUM_SNAPSHOT_FILTER, {'in_progress': IN_PROGRESS_FILTER,
+                                                                'bugs': OPEN_BUGS_FILTER})
+    stories_by_owner = group_stories_by_owner(sections['in_progress'])
+    tags = project_tags(projects)
 
-    print bold("{} SCRUM -- {}".format(project.name, pretty_date()))
-    print
+    out = render.Renderer()
+    out.bold("{} SCRUM -- {}".format(', '.join(project.name for project in projects), pretty_date()))
+    out.line()
 
     for owner in stories_by_owner:
-        print bold(owner)
+        out.bold(owner)
         for story in stories_by_owner[owner]:
-            print "   #{:12s}{:9s} {:7s} {}".format(story.story_id,
-                                                    estimate_visual(story.estimate),
-                                                    story.story_type,
-                                                    story.name)
+            out.line(u"   #{:12s}{:9s} {:7s} {}{}".format(story.story_id,
+                                                          estimate_visual(story.estimate),
+                                                          story.story_type,
+                                                          tags.get(story.project_id, ''),
+                                                          story.name))
 
-        print
+        out.line()
 
-    print bold("Bugs")
-    bugs = project.open_bugs()
+    out.bold("Bugs")
+    bugs = sections['bugs']
     if len(bugs) == 0:
-        print 'Not sure that I believe it, but there are no bugs'
+        out.line('Not sure that I believe it, but there are no bugs')
     for bug in bugs:
-        print "   #{:12s} {:4s} {}".format(bug.story_id,
-                                     initials(bug.owned_by),
-                                     bug.name)
+        out.line(u"   #{:12s} {:4s} {}{}".format(bug.story_id,
+                                               initials(bug.owned_by),
+                                               tags.get(bug.project_id, ''),
+                                               bug.name))
+    out.flush()
 
 
 def poker(project):
@@ -240,32 +316,54 @@ def poker(project):
     Will loop through and display unestimated stories, and prompt the team for an estimate.
     You can also open the current story in a browser for additional editing
     """
-    total_stories = len(project.unestimated_stories())
-    for idx, story in enumerate(project.unestimated_stories()):
-        clear()
-        rows, cols = _get_column_dimensions()
-        print "{} PLANNING POKER SESSION [{}]".format(project.name.upper(), bold("{}/{} Stories Estimated".format(idx+1, total_stories)))
-        print "-" * cols
-        pretty_print_story(story)
-        prompt_estimation(project, story)
-    else:
-        print "KaBoom!!! Nice Work Team"
+    use_snapshot(project, POKER_SNAPSHOT_FILTER)
+    stories = project.unestimated_stories()
+    total_stories = len(stories)
+
+    # Estimates are saved in the background, and the next stories are reloaded while the team discusses
+    # the current one, so the session never waits on the network between stories
+    from multiprocessing.pool import ThreadPool
+    estimate_writer = ThreadPool(2)
+    saved_estimates = []
+
+    def save_estimate(story, value):
+        saved_estimates.append((story, estimate_writer.apply_async(story.assign_estimate, (value,))))
+
+    try:
+        for idx, story in enumerate(project.prefetch_stories(stories)):
+            clear()
+            rows, cols = _get_column_dimensions()
+            print "{} PLANNING POKER SESSION [{}]".format(project.name.upper(), bold("{}/{} Stories Estimated".format(idx+1, total_stories)))
+            print "-" * cols
+            pretty_print_story(story)
+            prompt_estimation(project, story, save_estimate)
+        else:
+            print "KaBoom!!! Nice Work Team"
+    finally:
+        estimate_writer.close()
+        estimate_writer.join()
+        for story, result in saved_estimates:
+            if not result.successful():
+                print "Could not save the estimate for #{} {}".format(story.story_id, story.name)
 
 
 def load_story(story_id, arguments):
-    story = None
+    return Story.find(story_id, project_index=_project_index(arguments))
+
+
+def _project_index(arguments):
+    """the zero based project index passed with --project-index, or None"""
     if arguments['--project-index'] is not None and arguments['--project-index'].isdigit():
-        idx = int(arguments['--project-index']) - 1
-        story = Story.find(story_id, project_index=idx)
+        return int(arguments['--project-index']) - 1
     else:
-
-        story = Story.find(story_id)
-    return story
+        return None
 
 
 def browser_open(story_id, arguments):
     """Open the given story in a browser"""
 
+    import webbrowser
+
     story = load_story(story_id, arguments)
 
     webbrowser.open(story.url)
@@ -289,49 +387,256 @@ def create_story(project, arguments):
     project.create_story(stories)
 
 
+def import_stories(project, arguments):
+    """Creates stories from a csv or jsonl file, printing a line as each one is created"""
+
+    path = arguments['<file>']
+    print_lock = threading.Lock()
+
+    def report(row_number, story, error):
+        with print_lock:
+            if error is None:
+                print "[{}] {}".format(row_number, story.get('name', ''))
+            else:
+                print "[{}] {} failed: {}".format(row_number, story.get('name', ''), error)
+
+    import importer
+    try:
+        rate = float(arguments['--rate'])
+    except ValueError:
+        rate = 0
+    if rate <= 0:
+        print "The rate is a number of stories per second, above 0"
+        exit(1)
+
+    if not os.path.isfile(path):
+        print "No such file: {}".format(path)
+        exit(1)
+
+    try:
+        counts = importer.import_stories(project, path, rate=rate, report=report)
+    except importer.InvalidRowError, e:
+        print "Stopped, {} of {}.  Fix it and run the import again".format(e, path)
+        exit(1)
+    except ValueError, e:
+        print e
+        exit(1)
+    except IOError, e:
+        print "Can not read {}: {}".format(path, e.strerror)
+        exit(1)
+
+    print
+    print "{created} created, {skipped} already imported, {failed} failed".format(**counts)
+    if counts['failed'] > 0:
+        print "Run the import again to retry the failed rows"
+
+
+def export_stories(project, arguments):
+    """Streams every story of the project to a file, or stdout, as jsonl or csv"""
+    import exporter
+
+    path = arguments['<file>']
+    export_format = arguments['--format'] or exporter.format_for(path)
+    if export_format not in exporter.FORMATS:
+        print "Can not export to {}, use one of: {}".format(export_format, ', '.join(exporter.FORMATS))
+        exit(1)
+
+    # Progress goes to stderr, keeping stdout for the stories themselves, and only to a terminal
+    progress = sys.stderr.isatty()
+
+    def report(count):
+        sys.stderr.write("\rExported {} stories".format(count))
+        sys.stderr.flush()
+
+    out = open(path, 'wb') if path else sys.stdout
+    try:
+        count = exporter.export_stories(project, out, export_format, report=report if progress else None)
+    except IOError, e:
+        if e.errno != errno.EPIPE:
+            raise
+        # Whatever read the export stopped early, as with export | head.  stdout is pointed at /dev/null so
+        # flushing it on the way out does not fail again
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        exit(1)
+    finally:
+        if path:
+            out.close()
+
+    sys.stderr.write("{}Exported {} stories from {}\n".format('\r' if progress else '', count, project.name))
+
+
+def sync(project, arguments):
+    """Mirrors the project's stories locally, for use with --cached"""
+    count = project.sync(full=arguments['--full'])
+    print "Synced {} stories of {}".format(count, project.name)
+
+
 def update_status(arguments):
+    """Moves one or more stories to a new state.
+    The stories are loaded and updated concurrently, then a line is printed per story
+    """
 
-    story = None
-    if '<story_id>' in arguments:
-        story_id = arguments['<story_id>']
-        story = load_story(story_id, arguments)
+    story_ids = read_story_ids(arguments['<story_ids>'])
+    transition = [name for name in TRANSITIONS if arguments[name]][0]
+
+    found = Story.find_many(story_ids, project_index=_project_index(arguments))
+    stories = [found[story_id][0] for story_id in story_ids if found[story_id][0] is not None]
+
+    failures = 0
+    not_found = []
+    for story_id in story_ids:
+        story, error = found[story_id]
+        if error is not None:
+            print "Story: [{}] could not be loaded: {}".format(story_id, error)
+            failures += 1
+        elif story is None:
+            not_found.append(story_id)
+            failures += 1
+
+    for story, error in transition_stories(stories, transition):
+        if error is None:
+            print "Story: [{}] {} is {}".format(story.story_id, story.name, TRANSITIONS[transition])
+        else:
+            print "Story: [{}] {} failed: {}".format(story.story_id, story.name, error)
+            failures += 1
 
-    if story is not None:
-        try:
+    if not_found:
+        print "No project found for {}".format(', '.join('#{}'.format(story_id) for story_id in not_found))
+
+    if len(story_ids) > 1:
+        print
+        print "{} of {} stories {}".format(len(story_ids) - failures, len(story_ids), TRANSITIONS[transition])
+
+    if failures > 0:
+        exit(1)
+
+
+def manage_daemon(arguments):
+    """Starts, stops or reports on the background daemon"""
+    import daemon
 
-            if arguments['start']:
-                story.start()
-                print "Story: [{}] {} is STARTED".format(story.story_id, story.name)
-            elif arguments['finish']:
-                story.finish()
-                print "Story: [{}] {} is FINISHED".format(story.story_id, story.name)
-            elif arguments['deliver']:
-                story.deliver()
-                print "Story: [{}] {} is DELIVERED".format(story.story_id, story.name)
-            elif arguments['accept']:
-                story.accept()
-                print "Story: [{}] {} is ACCEPTED".format(story.story_id, story.name)
-            elif arguments['reject']:
-                story.reject()
-                print "Story: [{}] {} is REJECTED".format(story.story_id, story.name)
-
-        except InvalidStateException, e:
-            print e.message
+    running = daemon.status()
+    if arguments['start']:
+        if running is not None:
+            print "The daemon is already running (pid {})".format(running['pid'])
+        elif daemon.start():
+            print "Daemon started, show, scrum, changelog and state changes now go through it"
+        else:
+            print "The daemon did not start, see {}".format(daemon.log_path())
+            exit(1)
+    elif arguments['stop']:
+        if running is None:
+            print "The daemon is not running"
+        else:
+            daemon.stop()
+            print "Daemon stopped"
+    elif running is None:
+        print "The daemon is not running"
     else:
-        print "hmmm could not find story"
+        print "Daemon {pid} up for {uptime:.0f}s, {commands} commands run, {responses} responses in memory".format(
+            **running)
+
+
+def read_story_ids(story_ids):
+    """returns the story ids passed on the command line, reading them from stdin if passed -.
+    An id given more than once is only returned the first time, so each story is only updated once
+    """
+    if story_ids == ['-']:
+        story_ids = sys.stdin.read().split()
+    return list(OrderedDict.fromkeys(story_id.lstrip('#') for story_id in story_ids))
 
 
 
 ## Helper Methods
 
+# Broad queries covering everything a command asks for, so it can be fetched once and filtered locally
+CHANGELOG_SNAPSHOT_FILTER = 'state:delivered,finished,unscheduled,unstarted,started,rejected type:feature,bug'
+SCRUM_SNAPSHOT_FILTER = 'state:started,rejected,unstarted'
+POKER_SNAPSHOT_FILTER = 'state:unstarted type:feature,bug'
+
+
+def use_snapshot(project, filter_string):
+    """fetches the stories for a command in one request, unless they are being read from the mirror"""
+    if project.mirror is None:
+        project.load_snapshot(filter_string)
+
+
+def fetch_sections(projects, snapshot_filter, filters):
+    """Runs a report's queries (a dict of section name -> filter) against every project at once.
+    Returns a dict of section name -> stories, with each section's stories merged in project order.
+
+    The queries run concurrently, so a snapshot saves requests but not time.  It is only taken when the backend
+    selects fields, as full v3 stories make the broader snapshot cost more bytes than the queries it replaces
+    """
+    snapshot = get_backend().selects_fields
+
+    def fetch(project):
+        if snapshot:
+            use_snapshot(project, snapshot_filter)
+        return project.get_stories_for_filters(filters)
+
+    sections = dict((name, []) for name in filters)
+    for project_sections in concurrent_map(fetch, projects):
+        for name in filters:
+            sections[name].extend(project_sections[name])
+    return sections
+
+
+def project_tags(projects):
+    """maps project ids to the '[name] ' prefix of story lines, empty when reporting on a single project"""
+    if len(projects) <= 1:
+        return {}
+    return dict((project.project_id, '[{}] '.format(project.name)) for project in projects)
+
 
 
 def bold(string):
     return colored(string, 'white', attrs=['bold'])
 
 
+def colored(text, color=None, on_color=None, attrs=None):
+    """termcolor.colored, imported on first use.  Text written anywhere but a terminal is left plain"""
+    return render.colored(text, color, on_color, attrs)
+
+
 def prompt_project(arguments):
     """prompts the user for a project, if not passed in as a argument"""
+    project = _prompt_project(arguments)
+    if arguments.get('--cached'):
+        _use_mirror(project)
+    return project
+
+
+def prompt_projects(arguments):
+    """The projects a report covers: every project with --all-projects, the projects listed in
+    --project-index (such as 1,3,5), or else the single project picked by prompt_project
+    """
+    if arguments.get('--all-projects'):
+        projects = Project.all()
+    elif arguments['--project-index'] is not None and ',' in arguments['--project-index']:
+        all_projects = Project.all()
+        try:
+            projects = [all_projects[int(idx) - 1] for idx in arguments['--project-index'].split(',')]
+        except (ValueError, IndexError):
+            print 'Yikes, that did not work -- try again?'
+            exit()
+    else:
+        return [prompt_project(arguments)]
+
+    if arguments.get('--cached'):
+        for project in projects:
+            _use_mirror(project)
+    return projects
+
+
+def _use_mirror(project):
+    project.use_mirror()
+    if project.mirror.last_synced(project.project_id) is None:
+        print "{} has not been synced yet, run: pivotal_tools sync".format(project.name)
+        exit()
+
+
+def _prompt_project(arguments):
     projects = Project.all()
 
     # Do not prompt -- and auto select the one project if a account only has one project
@@ -422,7 +727,6 @@ def group_stories_by_label(stories):
 
 
 def pretty_date():
-    from datetime import datetime
     return datetime.now().strftime('%b %d, %Y')
 
 
@@ -465,7 +769,8 @@ def pretty_print_story(story):
         print "{} {}".format(bold('Labels:'), story.labels)
 
 
-def prompt_estimation(project, story):
+def prompt_estimation(project, story, save_estimate=None):
+    """prompts for an estimate and saves it, through save_estimate(story, value) if given"""
     print
     print bold("Estimate: [{}, (s)kip, (o)pen, (q)uit]".format(','.join(project.point_scale)))
     input_value = raw_input(bold('>> '))
@@ -474,21 +779,28 @@ def prompt_estimation(project, story):
         #skip move to the next
         return
     elif input_value in ['o', 'O']:
+        import webbrowser
         webbrowser.open(story.url)
-        prompt_estimation(project, story)
+        prompt_estimation(project, story, save_estimate)
     elif input_value in ['q','Q']:
         exit()
     elif input_value in project.point_scale:
         value = int(input_value)
-        story.assign_estimate(value)
+        if save_estimate is not None:
+            save_estimate(story, value)
+        else:
+            story.assign_estimate(value)
     else:
         print "Invalid Input, Try again"
-        prompt_estimation(project, story)
+        prompt_estimation(project, story, save_estimate)
 
 
 def _get_column_dimensions():
-    rows, cols = os.popen('stty size', 'r').read().split()
-    return int(rows), int(cols)
+    size = render.terminal_size()
+    if size is None:
+        # Not attached to a terminal, or on Windows
+        return 24, 80
+    return size
 
 
 def x_or_space(complete):
@@ -504,9 +816,118 @@ def main():
 
     check_api_token()
 
+    # Commands the daemon can answer are handed to it when it is running, see daemon.py
+    import daemon
+    if daemon.is_present() and daemon.forwardable(arguments):
+        code = daemon.forward(sys.argv[1:])
+        if code is not None:
+            exit(code)
+
+    if arguments['--refresh']:
+        Project.clear_cache()
+
+    profile = None
+    if arguments['--profile']:
+        profile = Profile()
+        profile.start()
+
+    try:
+        execute(arguments)
+    finally:
+        if profile is not None:
+            profile.stop()
+            profile.report()
+        if daemon.is_present() and daemon.changes_stories(arguments):
+            daemon.notify_changed()
+
+
+def execute(arguments):
+    """runs a parsed command line, reporting a Tracker that can not be reached"""
+    import requests
+    try:
+        run_command(arguments)
+    except requests.exceptions.RequestException, e:
+        print "Could not get through to Pivotal Tracker: {}".format(e)
+        exit(1)
+
+
+class Profile(object):
+    """Collects the cost of every API call made by a command, and the time spent writing its output,
+    and prints a breakdown to stderr when the command finishes
+    """
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+        self.started = None
+        self.finished = None
+        self.output = None
+
+    def start(self):
+        self.started = time.time()
+        self.output = _TimedOutput(sys.stdout)
+        sys.stdout = self.output
+        add_request_hook(self.record)
+
+    def stop(self):
+        remove_request_hook(self.record)
+        sys.stdout = self.output.stream
+        self.finished = time.time()
+
+    def record(self, event):
+        with self.lock:
+            self.events.append(event)
+
+    def report(self, out=sys.stderr):
+        events = list(self.events)
+        wall = self.finished - self.started
+        network = sum(event.latency for event in events)
+        parsing = sum(event.parse_time for event in events)
+        methods = {}
+        for event in events:
+            methods[event.method] = methods.get(event.method, 0) + 1
+
+        out.write('\nProfile\n')
+        out.write('  wall      {:8.0f}ms\n'.format(wall * 1000))
+        out.write('  network   {:8.0f}ms  {} requests ({}), {} responses from cache, {} bytes\n'.format(
+            network * 1000, len(events), ', '.join('{} {}'.format(n, m) for m, n in sorted(methods.items())),
+            len([event for event in events if event.status == 304]), sum(event.bytes for event in events)))
+        out.write('  parsing   {:8.0f}ms  {} stories\n'.format(
+            parsing * 1000, sum(event.story_count for event in events)))
+        out.write('  output    {:8.0f}ms  {} bytes written\n'.format(self.output.time * 1000, self.output.bytes))
+        if len(events) > 1:
+            out.write('  (concurrent requests overlap, so network and parsing can add up to more than wall)\n')
+
+        if events:
+            out.write('\n  slowest requests\n')
+            for event in sorted(events, key=lambda event: event.latency + event.parse_time, reverse=True)[:5]:
+                out.write('  {:8.0f}ms {:6.0f}ms parse  {}  {:8d} bytes  {:4d} stories  {} {}\n'.format(
+                    event.latency * 1000, event.parse_time * 1000, event.status, event.bytes, event.story_count,
+                    event.method, event.url))
+
+
+class _TimedOutput(object):
+    """wraps a file, counting the time spent in and the bytes passed to write"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.time = 0.0
+        self.bytes = 0
+
+    def write(self, data):
+        started = time.time()
+        self.stream.write(data)
+        self.time += time.time() - started
+        self.bytes += len(data)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def run_command(arguments):
     if arguments['changelog']:
-        project = prompt_project(arguments)
-        generate_changelog(project)
+        projects = prompt_projects(arguments)
+        generate_changelog(projects)
     elif arguments['show'] and arguments['stories']:
         project = prompt_project(arguments)
         show_stories(project, arguments)
@@ -515,14 +936,25 @@ def main():
     elif arguments['open']:
         browser_open(arguments['<story_id>'], arguments)
     elif arguments['scrum']:
-        project = prompt_project(arguments)
-        scrum(project)
+        projects = prompt_projects(arguments)
+        scrum(projects)
     elif arguments['poker'] or arguments['planning']:
         project = prompt_project(arguments)
         poker(project)
     elif arguments['create']:
         project = prompt_project(arguments)
         create_story(project, arguments)
+    elif arguments['sync']:
+        project = prompt_project(arguments)
+        sync(project, arguments)
+    elif arguments['export']:
+        project = prompt_project(arguments)
+        export_stories(project, arguments)
+    elif arguments['import']:
+        project = prompt_project(arguments)
+        import_stories(project, arguments)
+    elif arguments['daemon']:
+        manage_daemon(arguments)
     elif arguments['story']:
         update_status(arguments)
     else:
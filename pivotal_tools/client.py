@@ -0,0 +1,55 @@
+"""Non blocking access to Tracker, for programs that serve many users at once (bots, web apps)
+
+Every call returns immediately with an AsyncResult (see multiprocessing.pool), whose get() waits for
+and returns the value, or re-raises the error.  Calls run on a fixed pool of workers sharing the
+module's keep-alive connection pool, so the number of threads does not grow with the number of
+requests.  Responses are decoded by the same models as the blocking api in pivotal.py.
+
+    client = AsyncClient()
+    projects = client.all_projects().get()
+    pending = [client.get_stories(project, 'state:started') for project in projects]
+    started = [result.get() for result in pending]
+
+Pass callback=func to have func called with the value as soon as it arrives instead.
+"""
+
+# Core Imports
+from multiprocessing.pool import ThreadPool
+
+# Local Imports
+from pivotal import Project, Story, MAX_WORKERS
+
+
+class AsyncClient(object):
+
+    def __init__(self, workers=MAX_WORKERS):
+        self.pool = ThreadPool(workers)
+
+    def all_projects(self, callback=None):
+        return self.pool.apply_async(Project.all, callback=callback)
+
+    def get_stories(self, project, filter_string, callback=None):
+        return self.pool.apply_async(project.get_stories, (filter_string,), callback=callback)
+
+    def get_stories_for_filters(self, project, filters, callback=None):
+        return self.pool.apply_async(project.get_stories_for_filters, (filters,), callback=callback)
+
+    def load_story(self, project, story_id, callback=None):
+        return self.pool.apply_async(project.load_story, (story_id,), callback=callback)
+
+    def find_story(self, story_id, callback=None):
+        return self.pool.apply_async(Story.find, (story_id,), callback=callback)
+
+    def create_story(self, project, story_dict, callback=None):
+        return self.pool.apply_async(project.create_story, (story_dict,), callback=callback)
+
+    def set_state(self, story, state, callback=None):
+        return self.pool.apply_async(story.set_state, (state,), callback=callback)
+
+    def assign_estimate(self, story, estimate, callback=None):
+        return self.pool.apply_async(story.assign_estimate, (estimate,), callback=callback)
+
+    def close(self):
+        """waits for the outstanding calls to finish, and stops the workers"""
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,433 @@
+"""Optional background process keeping a warm connection pool, and the stories recent commands read, in memory
+
+    pivotal_tools daemon start      # detaches, and serves until stopped
+    pivotal_tools daemon status
+    pivotal_tools daemon stop
+
+While it runs, show stories, show story, scrum, changelog and the story transitions are sent to it over
+a unix socket in the cache directory and run there, and their output passed back as it is written.  A
+query the daemon answered less than MAX_AGE seconds ago is answered again from memory, without a request,
+and every REFRESH_INTERVAL seconds the queries used in the last HOT_WINDOW seconds are revalidated in the
+background, so repeated commands answer without waiting on the network.  The price is that answers can
+be up to REFRESH_INTERVAL seconds behind changes made elsewhere (the Tracker web site, another user).
+
+Commands that prompt, read stdin or write files run directly, as does everything when the daemon is not
+running, was started with another token, api or api url, or fails before passing on output or changing
+a story.  Changes made directly tell the daemon to revalidate what it holds.
+"""
+
+# Core Imports
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import traceback
+import SocketServer
+from StringIO import StringIO
+
+# 3rd Party Imports
+from docopt import docopt, DocoptExit
+
+# Local Imports
+import cache
+import render
+import pivotal
+
+SOCKET_FILE = 'daemon.sock'
+LOG_FILE = 'daemon.log'
+
+# Seconds between background refreshes of the queries in use, and how recently a query must have been
+# used to be refreshed.  Responses are answered from memory for up to MAX_AGE seconds
+REFRESH_INTERVAL = float(os.getenv('PIVOTAL_DAEMON_REFRESH', 15))
+HOT_WINDOW = int(os.getenv('PIVOTAL_DAEMON_HOT_WINDOW', 30 * 60))
+MAX_AGE = 2 * REFRESH_INTERVAL
+
+# Seconds the client waits for a command to run, and start() for the daemon to come up
+COMMAND_TIMEOUT = 300
+START_TIMEOUT = 5
+
+# Bytes of a command's output held before they are passed on, when the command does not flush them itself
+OUTPUT_BUFFER = 64 * 1024
+
+# Commands that can run in the daemon: those that do not prompt, read stdin or write files
+FORWARDED_COMMANDS = ['changelog', 'scrum', 'show', 'start', 'finish', 'deliver', 'accept', 'reject']
+
+# Commands that change stories when run directly, after which the daemon should revalidate.  The
+# transitions also do when given ids on stdin
+CHANGING_COMMANDS = ['create', 'import', 'poker', 'planning']
+
+# Printed when a command fails part way, too late for the client to run it again
+FAILED_MESSAGE = 'The daemon could not finish the command, see {}'
+
+_command_lock = threading.Lock()
+_projects_checked_at = 0
+
+
+def socket_path():
+    return cache.cache_path(SOCKET_FILE)
+
+
+def log_path():
+    return cache.cache_path(LOG_FILE)
+
+
+def is_present():
+    """whether a daemon socket exists, cheaper than asking the daemon whether it is running"""
+    return os.path.exists(socket_path())
+
+
+def config_key():
+    """identifies the token and api a process talks to, the daemon only runs commands for its own"""
+    return cache.fingerprint(pivotal.TOKEN, pivotal.API_VERSION, pivotal.API_URL)
+
+
+def forwardable(arguments):
+    """whether a parsed command line can be run by the daemon"""
+    if arguments['--profile'] or arguments['daemon']:
+        return False
+    if arguments['<story_ids>'] == ['-']:
+        return False
+    return any(arguments.get(command) for command in FORWARDED_COMMANDS)
+
+
+def changes_stories(arguments):
+    """whether a command run directly may have changed stories the daemon holds"""
+    if arguments['story'] and not arguments['show']:
+        return True
+    return any(arguments.get(command) for command in CHANGING_COMMANDS)
+
+
+## Client
+
+def forward(argv, stdout=None):
+    """Runs a command line in the daemon, writing its output to stdout as it arrives.
+    Returns the command's exit code, or None if the command should run directly instead
+    """
+    stdout = stdout or sys.stdout
+    try:
+        connection = _connect()
+    except socket.error:
+        return None
+
+    written = False
+    try:
+        connection.settimeout(COMMAND_TIMEOUT)
+        reader = _send(connection, {'action': 'run', 'argv': argv, 'tty': _isatty(stdout),
+                                    'encoding': getattr(stdout, 'encoding', None),
+                                    'size': render.terminal_size(stdout)})
+        while True:
+            reply = json.loads(reader.readline() or 'null')
+            if reply is None or reply.get('status') == 'fallback':
+                break
+            if 'output' not in reply:
+                return reply['code']
+            stdout.write(reader.read(reply['output']))
+            stdout.flush()
+            written = True
+    except (socket.error, ValueError):
+        # ValueError covers arguments that are not utf-8, which can not be sent as json
+        pass
+    finally:
+        connection.close()
+
+    if written:
+        # The daemon went away part way through, the command may have changed stories already
+        stdout.write(FAILED_MESSAGE.format(log_path()) + '\n')
+        return 1
+    return None
+
+
+def notify_changed():
+    """tells a running daemon that stories changed, so it revalidates before answering from memory"""
+    return _ask({'action': 'expire'}) is not None
+
+
+def status():
+    """returns a dict describing the running daemon, or None if none is running"""
+    return _ask({'action': 'status'})
+
+
+def stop():
+    """stops the running daemon, returns False if none was running"""
+    return _ask({'action': 'stop'}) is not None
+
+
+def start():
+    """Starts the daemon in the background, detached from the terminal.
+    Returns False if one is already running, or did not come up within START_TIMEOUT seconds
+    """
+    if status() is not None:
+        return False
+
+    try:
+        os.makedirs(cache.CACHE_DIR)
+    except OSError:
+        pass
+
+    pid = os.fork()
+    if pid == 0:
+        # Detach from the terminal, then fork again so the daemon is not a session leader
+        os.setsid()
+        if os.fork() != 0:
+            os._exit(0)
+        _redirect_stdio(log_path())
+        code = 0
+        try:
+            serve()
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            # os._exit skips the interpreter's own flushing
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    os.waitpid(pid, 0)
+    deadline = time.time() + START_TIMEOUT
+    while time.time() < deadline:
+        if status() is not None:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def _ask(message):
+    """sends a message to the daemon, returns its reply or None if it is not running"""
+    try:
+        connection = _connect()
+    except socket.error:
+        return None
+    try:
+        connection.settimeout(START_TIMEOUT)
+        return json.loads(_send(connection, message).readline() or 'null')
+    except (socket.error, ValueError):
+        return None
+    finally:
+        connection.close()
+
+
+def _connect():
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path())
+    except socket.error:
+        connection.close()
+        raise
+    return connection
+
+
+def _send(connection, message):
+    """writes a message, with the config key, and returns a file to read the reply from"""
+    message = dict(message, key=config_key())
+    connection.sendall(json.dumps(message) + '\n')
+    return connection.makefile('rb')
+
+
+def _isatty(stream):
+    isatty = getattr(stream, 'isatty', None)
+    return bool(isatty and isatty())
+
+
+def _redirect_stdio(log_path):
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with open(os.devnull) as devnull:
+        os.dup2(devnull.fileno(), 0)
+    with open(log_path, 'a') as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+
+
+## Server
+
+def serve(path=None):
+    """Serves commands on the unix socket until stopped, refreshing the queries in use in the background"""
+    class Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+        daemon_threads = True
+
+    path = path or socket_path()
+    if os.path.exists(path):
+        # Left behind by a daemon that did not shut down cleanly
+        os.remove(path)
+
+    pivotal.RESPONSE_MAX_AGE = MAX_AGE
+
+    # Only the user may connect
+    umask = os.umask(0177)
+    try:
+        server = Server(path, _Handler)
+    finally:
+        os.umask(umask)
+    server.key = config_key()
+    server.started = time.time()
+    server.commands = 0
+
+    stopped = threading.Event()
+    refresher = threading.Thread(target=_refresh_forever, args=(stopped,))
+    refresher.daemon = True
+    refresher.start()
+
+    print '{} daemon {} serving on {}'.format(time.strftime('%Y-%m-%d %H:%M:%S'), os.getpid(), path)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    finally:
+        stopped.set()
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _refresh_forever(stopped):
+    while not stopped.wait(REFRESH_INTERVAL):
+        pivotal.refresh_responses(HOT_WINDOW)
+
+
+class _Handler(object):
+    """Answers one message: run, expire, status or stop.  Replies are lines of json.  For run, a reply with an
+    output length is followed by that many bytes of the command's output, and the last reply has the exit code
+    """
+
+    def __init__(self, request, client_address, server):
+        self.server = server
+        self.rfile = request.makefile('rb')
+        self.wfile = request.makefile('wb')
+        try:
+            self.handle()
+        finally:
+            self.wfile.close()
+            self.rfile.close()
+
+    def handle(self):
+        try:
+            message = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+
+        if message['action'] == 'run' and message.get('key') != self.server.key:
+            # Started with another token or api, the client runs the command itself
+            self.reply({'status': 'fallback'})
+        elif message['action'] == 'run':
+            output = _Output(self.wfile, message.get('tty'), message.get('encoding'), message.get('size'))
+            reply = run_command(message['argv'], output)
+            self.server.commands += 1
+            self.reply(reply)
+        elif message['action'] == 'expire':
+            pivotal.expire_responses()
+            self.reply({'status': 'ok'})
+        elif message['action'] == 'status':
+            self.reply({'status': 'ok', 'pid': os.getpid(), 'uptime': time.time() - self.server.started,
+                        'commands': self.server.commands, 'responses': pivotal.response_count()})
+        elif message['action'] == 'stop':
+            self.reply({'status': 'ok'})
+            # shutdown waits for serve_forever to return, so it can not be called from a request
+            threading.Thread(target=self.server.shutdown).start()
+
+    def reply(self, reply):
+        self.wfile.write(json.dumps(reply) + '\n')
+        self.wfile.flush()
+
+
+def run_command(argv, output):
+    """Runs a command line in this process, writing its output to output, an _Output.
+    Returns the last reply for the client.  Commands that want input, or fail unexpectedly, are handed back
+    to the client to run directly, unless they already sent output or a change to Tracker, as running them
+    again would repeat it.  Those end with exit code 1
+    """
+    import cli
+
+    try:
+        # docopt only collects repeated arguments given as byte strings
+        arguments = docopt(cli.__doc__, [argument.encode('utf-8') for argument in argv], help=False)
+    except DocoptExit:
+        return {'status': 'fallback'}
+
+    with _command_lock:
+        _fresh_projects(arguments['--refresh'])
+        changes_sent = pivotal.changes_sent()
+        stdout, stdin = sys.stdout, sys.stdin
+        sys.stdout, sys.stdin = output, StringIO()
+        code = 0
+        try:
+            cli.execute(arguments)
+        except SystemExit, e:
+            code = _exit_code(e, output)
+        except Exception, e:
+            sys.stdout = stdout
+            if not isinstance(e, EOFError):
+                # EOFError is a prompt for input, anything else is logged
+                print 'Failed to run {}'.format(' '.join(argv))
+                traceback.print_exc()
+                sys.stdout.flush()
+            if not output.sent and pivotal.changes_sent() == changes_sent:
+                return {'status': 'fallback'}
+            output.write(FAILED_MESSAGE.format(log_path()) + '\n')
+            code = 1
+        finally:
+            sys.stdout, sys.stdin = stdout, stdin
+    output.flush()
+    return {'status': 'ok', 'code': code}
+
+
+def _fresh_projects(refresh):
+    """Gives the command its own copies of the projects, so mirrors and snapshots set up by earlier
+    commands are not seen by it.  The project list is reloaded as a direct run would reload it
+    """
+    global _projects_checked_at
+    if refresh:
+        pivotal.Project.clear_cache()
+    elif time.time() - _projects_checked_at > pivotal.PROJECTS_TTL:
+        pivotal.Project.reset_cache(reload=True)
+        _projects_checked_at = time.time()
+    else:
+        pivotal.Project.reset_cache()
+
+
+def _exit_code(error, output):
+    """the exit status of a SystemExit, as the interpreter would report it"""
+    if error.code is None:
+        return 0
+    if isinstance(error.code, int):
+        return error.code
+    output.write('{}\n'.format(error.code))
+    return 1
+
+
+class _Output(object):
+    """Stands in for the client's terminal, passing a command's output on to it each time it is flushed, or
+    OUTPUT_BUFFER bytes have been written.  Output that was never flushed, such as a menu printed before a
+    prompt, can still be dropped for the client to run the command itself
+    """
+
+    def __init__(self, wfile, tty, encoding, size):
+        self.wfile = wfile
+        self.tty = tty
+        self.encoding = encoding or 'utf-8'
+        self.terminal_size = size
+        self.chunks = []
+        self.buffered = 0
+        self.sent = False
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode(self.encoding, 'replace')
+        self.chunks.append(data)
+        self.buffered += len(data)
+        if self.buffered >= OUTPUT_BUFFER:
+            self.flush()
+
+    def flush(self):
+        if self.buffered:
+            data = ''.join(self.chunks)
+            self.wfile.write(json.dumps({'output': len(data)}) + '\n')
+            self.wfile.write(data)
+            self.wfile.flush()
+            self.chunks = []
+            self.buffered = 0
+            self.sent = True
+
+    def isatty(self):
+        return self.tty
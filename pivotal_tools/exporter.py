@@ -0,0 +1,104 @@
+"""Export of every story of a project, as JSON lines or CSV
+
+Stories are streamed off the wire a page at a time and written out as they arrive, and none are kept
+once written, nor added to the story index, so memory use stays flat however large the project is.
+
+Columns (or keys) use the Tracker field names import takes, so an export can be imported again::
+
+    id,project_id,name,description,story_type,estimate,current_state,owned_by,url,labels,notes,tasks,attachments
+
+labels are comma separated, as Tracker has them.  In CSV, notes, tasks and attachments are JSON arrays.
+"""
+
+# Core Imports
+import csv
+import json
+
+# Local Imports
+from pivotal import PAGE_SIZE, ALL_FIELDS
+
+FORMATS = ['jsonl', 'csv']
+
+# Every story, accepted ones included
+EXPORT_FILTER = 'includedone:true'
+
+COLUMNS = ['id', 'project_id', 'name', 'description', 'story_type', 'estimate', 'current_state', 'owned_by',
+           'url', 'labels', 'notes', 'tasks', 'attachments']
+
+
+def format_for(path):
+    """guesses the export format from a file name, defaulting to jsonl"""
+    if path is not None and path.lower().endswith('.csv'):
+        return 'csv'
+    return 'jsonl'
+
+
+def story_to_dict(story):
+    """returns a story as a dict of Tracker field names, with its notes, tasks and attachments"""
+    return {
+        'id': story.story_id,
+        'project_id': story.project_id,
+        'name': story.name,
+        'description': story.description,
+        'story_type': story.story_type,
+        'estimate': story.estimate,
+        'current_state': story.state,
+        'owned_by': story.owned_by,
+        'url': story.url,
+        'labels': story.labels,
+        'notes': [{'id': note.note_id, 'text': note.text, 'author': note.author} for note in story.notes],
+        'tasks': [{'id': task.task_id, 'description': task.description, 'complete': task.complete}
+                  for task in story.tasks],
+        'attachments': [{'id': attachment.attachment_id, 'description': attachment.description, 'url': attachment.url}
+                        for attachment in story.attachments],
+    }
+
+
+def export_stories(project, out, format='jsonl', filter_string=EXPORT_FILTER, page_size=PAGE_SIZE, report=None):
+    """Writes every story of the project matching the filter to the file like object out.
+    report(count) is called after each page, the last partial one included, with the number of stories
+    written so far.
+    Returns the number of stories written
+    """
+    if format not in FORMATS:
+        raise ValueError('Can not export to {}, use one of {}'.format(format, ', '.join(FORMATS)))
+
+    write = _csv_writer(out) if format == 'csv' else _jsonl_writer(out)
+
+    count = 0
+    for story in project.iter_stories(filter_string, page_size=page_size, fields=ALL_FIELDS, index=False):
+        write(story_to_dict(story))
+        count += 1
+        if report is not None and count % page_size == 0:
+            report(count)
+    if report is not None and count % page_size != 0:
+        # The last page was a partial one
+        report(count)
+    return count
+
+
+def _jsonl_writer(out):
+    def write(story):
+        out.write(json.dumps(story))
+        out.write('\n')
+    return write
+
+
+def _csv_writer(out):
+    writer = csv.writer(out)
+    writer.writerow(COLUMNS)
+
+    def write(story):
+        for collection in ['notes', 'tasks', 'attachments']:
+            story[collection] = json.dumps(story[collection])
+        writer.writerow([_csv_value(story[column]) for column in COLUMNS])
+    return write
+
+
+def _csv_value(value):
+    """the csv module in python 2 only writes byte strings"""
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
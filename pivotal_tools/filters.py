@@ -0,0 +1,152 @@
+"""Local evaluation of Tracker filter strings
+
+Understands the terms the tools use, with the same syntax as Tracker search::
+
+    state:delivered,finished type:feature owner:JT label:"needs review" estimate:-1 id:123,456 -label:blocked login
+
+Each key:value term matches stories with any of its comma separated values, a leading - negates
+the term, and bare words match the story name or description.  All terms must match.
+
+StorySet indexes a list of stories by state, type, owner, label, estimate and id once, so each query
+is a few set intersections instead of a scan of every story.
+"""
+
+# Core Imports
+import re
+
+FIELD_KEYS = ['state', 'type', 'owner', 'label', 'estimate', 'id']
+
+# Accepted by Tracker but meaningless once the stories are local
+IGNORED_KEYS = ['includedone']
+
+TERM_PATTERN = re.compile(r'(-?)(?:(\w+):)?("[^"]*"|\S+)')
+
+
+class FilterSyntaxError(Exception): pass
+
+
+class Term(object):
+    """one term of a filter, key is None for free text"""
+    __slots__ = ('key', 'values', 'negated')
+
+    def __init__(self, key, values, negated=False):
+        self.key = key
+        self.values = values
+        self.negated = negated
+
+
+def parse(filter_string):
+    """returns the list of Terms in a filter string"""
+    terms = []
+    for negated, key, value in TERM_PATTERN.findall(filter_string):
+        if key in IGNORED_KEYS:
+            continue
+        if key and key not in FIELD_KEYS:
+            raise FilterSyntaxError("Can not evaluate '{}:' filters locally".format(key))
+
+        if key:
+            values = [_unquote(part).lower() for part in _split_values(value)]
+            if key == 'estimate':
+                try:
+                    values = [int(part) for part in values]
+                except ValueError:
+                    raise FilterSyntaxError('estimate takes numbers, not {}'.format(value))
+        else:
+            values = [_unquote(value).lower()]
+        terms.append(Term(key or None, values, negated == '-'))
+    return terms
+
+
+def states(filter_string):
+    """returns the set of states a filter is limited to, or None if it is not limited by state"""
+    return _limited(filter_string, 'state')
+
+
+def types(filter_string):
+    """returns the set of story types a filter is limited to, or None if it is not limited by type"""
+    return _limited(filter_string, 'type')
+
+
+def _limited(filter_string, key):
+    limited = None
+    for term in parse(filter_string):
+        if term.key == key and not term.negated:
+            limited = set(term.values) if limited is None else limited & set(term.values)
+    return limited
+
+
+def has_text(filter_string):
+    """whether a filter has free text terms, which match story names and descriptions"""
+    return any(term.key is None for term in parse(filter_string))
+
+
+class StorySet(object):
+    """A list of stories, indexed for answering filter strings locally"""
+
+    def __init__(self, stories):
+        self.stories = list(stories)
+        self.all = set(range(len(self.stories)))
+        self.indexes = dict((key, {}) for key in FIELD_KEYS)
+
+        for position, story in enumerate(self.stories):
+            self._add(position, 'state', story.state)
+            self._add(position, 'type', story.story_type)
+            self._add(position, 'estimate', story.estimate)
+            self._add(position, 'id', story.story_id)
+            if story.owned_by:
+                self._add(position, 'owner', story.owned_by.lower())
+                self._add(position, 'owner', _initials(story.owned_by).lower())
+            for label in (story.labels or '').split(','):
+                if label:
+                    self._add(position, 'label', label.lower())
+
+    def _add(self, position, key, value):
+        if isinstance(value, basestring):
+            value = value.lower()
+        self.indexes[key].setdefault(value, set()).add(position)
+
+    def query(self, filter_string):
+        """returns the stories matching the filter string, in their original order"""
+        matches = set(self.all)
+        text_terms = []
+
+        for term in parse(filter_string):
+            if term.key is None:
+                text_terms.append(term)
+                continue
+
+            index = self.indexes[term.key]
+            positions = set()
+            for value in term.values:
+                positions |= index.get(value, set())
+
+            if term.negated:
+                matches -= positions
+            else:
+                matches &= positions
+
+        for term in text_terms:
+            text = term.values[0]
+            found = set(position for position in matches if _contains(self.stories[position], text))
+            matches = matches - found if term.negated else found
+
+        return [self.stories[position] for position in sorted(matches)]
+
+
+def _contains(story, text):
+    return text in (story.name or '').lower() or text in (story.description or '').lower()
+
+
+def _split_values(value):
+    """splits on commas outside of quotes"""
+    return re.findall(r'"[^"]*"|[^,]+', value)
+
+
+def _unquote(value):
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1]
+    return value
+
+
+def _initials(full_name):
+    return ''.join([s[0] for s in full_name.split(' ') if s])
@@ -0,0 +1,154 @@
+"""Bulk import of stories from CSV or JSON lines files (.csv, or .jsonl / .json with one object per line)
+
+Each row (or line) describes one story using the Tracker field names, for example::
+
+    name,story_type,description,labels
+    Export to csv,feature,So reports can be built in a spreadsheet,reports
+
+Rows are created concurrently under a rate limit.  Every row that is created is recorded in a
+checkpoint file next to the import file, so re-running an interrupted import skips those rows.
+"""
+
+# Core Imports
+import os
+import csv
+import json
+import threading
+from multiprocessing.pool import ThreadPool
+
+# Local Imports
+from pivotal import RateLimiter, MAX_WORKERS
+
+# Story creations per second
+IMPORT_RATE = 5
+
+# The format of each file extension that can be imported
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.json': 'jsonl'}
+
+STORY_FIELDS = ['name', 'description', 'story_type', 'estimate', 'current_state', 'labels',
+                'requested_by', 'owned_by']
+
+
+class InvalidRowError(ValueError):
+    """a row of the import file that does not describe a story"""
+
+    def __init__(self, row_number, problem):
+        super(InvalidRowError, self).__init__('row {} {}'.format(row_number, problem))
+        self.row_number = row_number
+
+
+def format_for(path):
+    """returns the format of the file at path from its extension, raises ValueError if it can not be imported"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError('Can not import {}, only .csv, .jsonl and .json files'.format(path))
+    return FORMATS[extension]
+
+
+def read_rows(path):
+    """yields each row of a .csv or .jsonl file as a dict, one at a time.
+    Raises InvalidRowError for a .jsonl line that is not a json object, ValueError for a file of another type
+    """
+    import_format = format_for(path)
+    with open(path, 'rb') as import_file:
+        if import_format == 'csv':
+            for row in csv.DictReader(import_file):
+                yield row
+        else:
+            row_number = 0
+            for line in import_file:
+                if line.strip():
+                    row_number += 1
+                    try:
+                        row = json.loads(line)
+                    except ValueError, e:
+                        raise InvalidRowError(row_number, 'is not valid json: {}'.format(e))
+                    if not isinstance(row, dict):
+                        raise InvalidRowError(row_number, 'is not a json object')
+                    yield row
+
+
+def story_from_row(row):
+    """keeps the non empty story fields of a row"""
+    story = dict()
+    for field in STORY_FIELDS:
+        value = row.get(field)
+        if value is not None and value != '':
+            story[field] = value
+    return story
+
+
+class Checkpoint(object):
+    """Append only record of the row numbers that have been imported"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path) as checkpoint_file:
+                self.done = set(int(line) for line in checkpoint_file if line.strip())
+        except IOError:
+            self.done = set()
+
+    def __contains__(self, row_number):
+        return row_number in self.done
+
+    def add(self, row_number):
+        with self.lock:
+            with open(self.path, 'a') as checkpoint_file:
+                checkpoint_file.write('{}\n'.format(row_number))
+            self.done.add(row_number)
+
+
+def import_stories(project, path, rate=IMPORT_RATE, workers=MAX_WORKERS, report=None):
+    """Creates a story in the project for every row of the file at path.
+
+    Rows are read lazily, so only a handful are held in memory at any time.  report(row_number, story, error)
+    is called from a worker thread as each row completes, error is None on success.
+    Returns a dict counting the rows that were created, skipped (already imported) and failed.
+
+    Raises InvalidRowError, once the rows before it are done, when the file holds a row that is not a story.
+    Raises ValueError, before creating any, for a file that is not .csv, .jsonl or .json
+    """
+    if rate <= 0:
+        raise ValueError('The import rate must be above 0, not {}'.format(rate))
+    format_for(path)
+
+    checkpoint = Checkpoint(path + '.checkpoint')
+    limiter = RateLimiter(rate)
+    counts = {'created': 0, 'skipped': 0, 'failed': 0}
+    counts_lock = threading.Lock()
+
+    # A slot is taken for each row in flight, so we never read far ahead of the workers
+    slots = threading.BoundedSemaphore(workers)
+    pool = ThreadPool(workers)
+
+    def create(row_number, story):
+        error = None
+        try:
+            limiter.acquire()
+            project.create_story({'story': story})
+            checkpoint.add(row_number)
+        except Exception, e:
+            # Anything a row raises is reported as its failure, rather than lost in the pool
+            error = e
+        finally:
+            slots.release()
+
+        with counts_lock:
+            counts['failed' if error else 'created'] += 1
+        if report is not None:
+            report(row_number, story, error)
+
+    try:
+        for row_number, row in enumerate(read_rows(path), 1):
+            if row_number in checkpoint:
+                counts['skipped'] += 1
+                continue
+            slots.acquire()
+            pool.apply_async(create, (row_number, story_from_row(row)))
+    finally:
+        pool.close()
+        pool.join()
+
+    return counts
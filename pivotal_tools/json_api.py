@@ -0,0 +1,202 @@
+"""Backend for the Tracker v5 json API, selected with PIVOTAL_API_VERSION=5
+
+v5 lets a request name the fields it wants, so story listings only download the fields list views
+print (pivotal.LIST_FIELDS) instead of every description, comment and task.  Single stories are
+always fetched whole.  Responses decode into the same Story and Project objects as the v3 backend.
+
+v5 calls notes comments, and hangs attachments off them, both end up in story.notes and
+story.attachments as with v3.  Stories are created and updated by their v5 field names; owners and
+requesters are people ids in v5, so the owned_by and requested_by names v3 takes are not sent.
+"""
+
+# Core Imports
+import json
+from urllib import urlencode
+
+# Local Imports
+import pivotal
+from pivotal import Story, Project, Note, Task, Attachment, LIST_FIELDS, ALL_FIELDS, MAX_PAGE_SIZE
+from pivotal import STORY_DEFAULTS, PROJECT_DEFAULTS
+
+COMMENT_FIELDS = 'comments(id,text,person(name),file_attachments(id,filename,download_url))'
+
+# The v5 fields behind each Story attribute
+API_FIELDS = {
+    'story_id': 'id',
+    'project_id': 'project_id',
+    'name': 'name',
+    'description': 'description',
+    'owned_by': 'owners(name)',
+    'story_type': 'story_type',
+    'estimate': 'estimate',
+    'state': 'current_state',
+    'url': 'url',
+    'labels': 'labels(name)',
+    'notes': COMMENT_FIELDS,
+    'attachments': COMMENT_FIELDS,
+    'tasks': 'tasks(id,description,complete)',
+}
+
+# Story fields v5 does not take by name
+UNSUPPORTED_CREATE_FIELDS = ['owned_by', 'requested_by']
+
+
+class JsonBackend(object):
+    """Builds requests for, and decodes responses from, the v5 json API.  See pivotal.XmlBackend"""
+    default_url = 'https://www.pivotaltracker.com/services/v5'
+    list_fields = LIST_FIELDS
+    selects_fields = True
+    # v5 pages its listings, so unpaged queries are fetched MAX_PAGE_SIZE stories at a time
+    max_page_size = MAX_PAGE_SIZE
+
+    def url(self, path):
+        return (pivotal.API_URL or self.default_url) + path
+
+    def projects_url(self):
+        return self.url('/projects?fields=id,name,point_scale')
+
+    def parse_projects(self, body):
+        return [_decode_project(project) for project in json.loads(body)]
+
+    def project_url(self, project_id):
+        return self.url('/projects/{}?fields=id,name,point_scale'.format(project_id))
+
+    def parse_project(self, body):
+        return _decode_project(json.loads(body))
+
+    def stories_url(self, project_id, filter_string, limit=None, offset=None, fields=None):
+        parameters = [('filter', filter_string), ('fields', _api_fields(fields or self.list_fields))]
+        if limit is not None:
+            parameters.append(('limit', limit))
+        if offset:
+            parameters.append(('offset', offset))
+        return self.url('/projects/{}/stories?{}'.format(project_id, urlencode(parameters)))
+
+    def parse_stories(self, body):
+        return [_decode_story(story) for story in json.loads(body)]
+
+    def iter_stories(self, stream):
+        for story in json.load(stream):
+            yield _decode_story(story)
+
+    def story_url(self, project_id, story_id):
+        return self.url('/projects/{}/stories/{}?{}'.format(project_id, story_id,
+                                                            urlencode([('fields', _api_fields(ALL_FIELDS))])))
+
+    def parse_story(self, body):
+        return _decode_story(json.loads(body))
+
+    def update_story_request(self, project_id, story_id, field, value):
+        """returns the (url, body, headers) of a PUT setting one field of a story"""
+        url = self.url('/projects/{}/stories/{}'.format(project_id, story_id))
+        return url, json.dumps({field: value}), {'Content-Type': 'application/json'}
+
+    def create_story_request(self, project_id, story_dict):
+        """returns the (url, body, headers) of a POST creating a story"""
+        # Callers wrap the fields in a story element, as v3 wants them
+        story_dict = story_dict.get('story', story_dict)
+        story = dict((field, value) for field, value in story_dict.iteritems() if field not in UNSUPPORTED_CREATE_FIELDS)
+        if isinstance(story.get('labels'), basestring):
+            story['labels'] = [{'name': label} for label in story['labels'].split(',') if label]
+        if isinstance(story.get('estimate'), basestring):
+            story['estimate'] = int(story['estimate'])
+        url = self.url('/projects/{}/stories'.format(project_id))
+        return url, json.dumps(story), {'Content-Type': 'application/json'}
+
+    def modified_since(self, date):
+        """the filter term for stories modified since a date"""
+        return 'updated_since:{}/{}/{}'.format(date.month, date.day, date.year)
+
+
+def _api_fields(fields):
+    """the v5 fields parameter asking for the given Story attributes"""
+    api_fields = []
+    for field in fields:
+        if API_FIELDS[field] not in api_fields:
+            api_fields.append(API_FIELDS[field])
+    return ','.join(api_fields)
+
+
+def _string(value):
+    return unicode(value) if value is not None else u''
+
+
+def _integer(value):
+    return int(value) if value is not None else None
+
+
+def _first_name(people):
+    return people[0]['name'] if people else u''
+
+
+def _names(labels):
+    return u','.join(label['name'] for label in labels)
+
+
+def _notes(comments):
+    return [Note(_string(comment.get('id')), _string(comment.get('text')),
+                 _string((comment.get('person') or {}).get('name')))
+            for comment in comments]
+
+
+def _tasks(tasks):
+    return [Task(_string(task.get('id')), _string(task.get('description')), task.get('complete'))
+            for task in tasks]
+
+
+def _attachments(comments):
+    return [Attachment(_string(attachment.get('id')), _string(attachment.get('filename')),
+                       _string(attachment.get('download_url')))
+            for comment in comments for attachment in comment.get('file_attachments', [])]
+
+
+def _point_scale(value):
+    return value.split(',') if value else None
+
+
+# Decoding tables, mapping json keys to attributes for each model, as pivotal.py does for xml.
+# comments decode twice, into notes and attachments.  Fields a response leaves out get the xml defaults
+
+STORY_KEYS = {
+    'id': [('story_id', _string)],
+    'project_id': [('project_id', _string)],
+    'name': [('name', _string)],
+    'description': [('description', _string)],
+    'owners': [('owned_by', _first_name)],
+    'story_type': [('story_type', _string)],
+    'estimate': [('estimate', _integer)],
+    'current_state': [('state', _string)],
+    'url': [('url', _string)],
+    'labels': [('labels', _names)],
+    'comments': [('notes', _notes), ('attachments', _attachments)],
+    'tasks': [('tasks', _tasks)],
+}
+
+PROJECT_KEYS = {
+    'id': [('project_id', _string)],
+    'name': [('name', _string)],
+    'point_scale': [('point_scale', _point_scale)],
+}
+
+
+def _decode(data, keys, defaults):
+    """decodes a json object in a single pass over its keys, returns a dict of attribute -> value"""
+    values = dict(defaults)
+    for key, value in data.iteritems():
+        for attribute, convert in keys.get(key, ()):
+            values[attribute] = convert(value)
+    return values
+
+
+def _decode_story(data):
+    story = Story()
+    for attribute, value in _decode(data, STORY_KEYS, STORY_DEFAULTS).iteritems():
+        setattr(story, attribute, value)
+    if story.story_type == 'feature' and story.estimate is None:
+        # v5 leaves the estimate out of unestimated features, v3 sends -1
+        story.estimate = -1
+    return story
+
+
+def _decode_project(data):
+    return Project(**_decode(data, PROJECT_KEYS, PROJECT_DEFAULTS))
@@ -0,0 +1,330 @@
+"""Local SQLite mirror of a project's stories
+
+`pivotal_tools sync` copies every story of a project, with its notes, tasks, attachments and labels,
+into a SQLite database in the cache directory.  Commands passed --cached then read from the mirror
+instead of the network.
+
+An incremental sync only asks for stories modified since the previous sync.  With the v5 api it then
+lists the ids of every story, which is cheap as v5 can be asked for ids alone, to put the mirror in
+Tracker's priority order again and drop the stories deleted since.  v3 can not list ids alone, so there
+new and changed stories go to the end, and deleted stories stay, until the next full sync: the order of
+--cached listings is approximate in between.
+"""
+
+# Core Imports
+import os
+import time
+import sqlite3
+from datetime import datetime, timedelta
+
+# Local Imports
+import cache
+import filters
+from pivotal import Story, Note, Task, Attachment, PAGE_SIZE, MAX_PAGE_SIZE, ALL_FIELDS, get_backend
+
+MIRROR_FILE = 'mirror.sqlite3'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    project_id TEXT PRIMARY KEY,
+    synced_at REAL
+);
+CREATE TABLE IF NOT EXISTS stories (
+    story_id TEXT PRIMARY KEY,
+    project_id TEXT,
+    position INTEGER,
+    name TEXT,
+    description TEXT,
+    owned_by TEXT,
+    story_type TEXT,
+    estimate INTEGER,
+    state TEXT,
+    url TEXT,
+    labels TEXT
+);
+CREATE INDEX IF NOT EXISTS stories_by_project ON stories (project_id, position);
+CREATE TABLE IF NOT EXISTS notes (
+    story_id TEXT,
+    note_id TEXT,
+    text TEXT,
+    author TEXT
+);
+CREATE INDEX IF NOT EXISTS notes_by_story ON notes (story_id);
+CREATE TABLE IF NOT EXISTS tasks (
+    story_id TEXT,
+    task_id TEXT,
+    description TEXT,
+    complete INTEGER
+);
+CREATE INDEX IF NOT EXISTS tasks_by_story ON tasks (story_id);
+CREATE TABLE IF NOT EXISTS attachments (
+    story_id TEXT,
+    attachment_id TEXT,
+    description TEXT,
+    url TEXT
+);
+CREATE INDEX IF NOT EXISTS attachments_by_story ON attachments (story_id);
+CREATE TABLE IF NOT EXISTS labels (
+    story_id TEXT,
+    label TEXT
+);
+CREATE INDEX IF NOT EXISTS labels_by_label ON labels (label, story_id);
+"""
+
+STORY_COLUMNS = ['story_id', 'project_id', 'name', 'description', 'owned_by', 'story_type', 'estimate', 'state',
+                 'url', 'labels']
+
+# The column each filters.py key matches.  label: terms match the labels table
+FILTER_COLUMNS = {'state': 'state', 'type': 'story_type', 'owner': 'owned_by', 'label': 'label',
+                  'estimate': 'estimate', 'id': 'story_id'}
+
+# Matched case insensitively, as filters.StorySet does
+TEXT_FILTER_COLUMNS = ['state', 'type', 'owner', 'label']
+
+
+class NotMirroredError(Exception): pass
+
+
+class Mirror(object):
+    """SQLite copy of the stories of one or more projects"""
+
+    def __init__(self, path=None):
+        self.path = path or cache.cache_path(MIRROR_FILE)
+        self.created = False
+
+    def connect(self):
+        """opens a new connection, connections are not shared between threads.
+        The schema is created by the first connection only
+        """
+        if not self.created:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+        connection = sqlite3.connect(self.path)
+        connection.text_factory = unicode
+        connection.create_function('initials', 1, _initials)
+        if not self.created:
+            connection.executescript(SCHEMA)
+            self.created = True
+        return connection
+
+    def last_synced(self, project_id):
+        """returns the time the project was last synced, or None if it never was"""
+        connection = self.connect()
+        try:
+            return _last_synced(connection, project_id)
+        finally:
+            connection.close()
+
+    def sync(self, project, full=False):
+        """Copies the project's stories into the mirror, returns the number of stories written.
+        Unless full is set, only the stories modified since the last sync are fetched
+        """
+        started_at = time.time()
+        last_synced = None if full else self.last_synced(project.project_id)
+
+        story_filter = 'includedone:true'
+        if last_synced is not None:
+            # Tracker only takes a date, go back a day so nothing is missed across time zones
+            since = datetime.utcfromtimestamp(last_synced) - timedelta(days=1)
+            story_filter += ' ' + get_backend().modified_since(since)
+
+        connection = self.connect()
+        try:
+            with connection:
+                if last_synced is None:
+                    self._delete_project(connection, project.project_id)
+                    position = 0
+                else:
+                    position = connection.execute('SELECT COALESCE(MAX(position), -1) + 1 FROM stories WHERE project_id = ?',
+                                                  (project.project_id,)).fetchone()[0]
+
+                count = 0
+                for story in project.iter_stories(story_filter, page_size=PAGE_SIZE, fields=ALL_FIELDS):
+                    existing = connection.execute('SELECT position FROM stories WHERE story_id = ?',
+                                                  (story.story_id,)).fetchone()
+                    if existing is not None:
+                        self._write_story(connection, story, existing[0])
+                    else:
+                        self._write_story(connection, story, position)
+                        position += 1
+                    count += 1
+
+                if last_synced is not None and get_backend().selects_fields:
+                    self._reorder(connection, project)
+
+                connection.execute('INSERT OR REPLACE INTO projects (project_id, synced_at) VALUES (?, ?)',
+                                   (project.project_id, started_at))
+            return count
+        finally:
+            connection.close()
+
+    def _reorder(self, connection, project):
+        """rewrites the positions of the project's stories from Tracker's order, dropping the stories it no
+        longer has
+        """
+        connection.execute('CREATE TEMPORARY TABLE IF NOT EXISTS ordered (story_id TEXT PRIMARY KEY, position INTEGER)')
+        connection.execute('DELETE FROM ordered')
+        story_ids = (story.story_id for story in project.iter_stories('includedone:true', page_size=MAX_PAGE_SIZE,
+                                                                       fields=('story_id',)))
+        connection.executemany('INSERT OR IGNORE INTO ordered VALUES (?, ?)',
+                               ((story_id, position) for position, story_id in enumerate(story_ids)))
+
+        deleted = 'SELECT story_id FROM stories WHERE project_id = ? AND story_id NOT IN (SELECT story_id FROM ordered)'
+        for table in ['notes', 'tasks', 'attachments', 'labels']:
+            connection.execute('DELETE FROM {} WHERE story_id IN ({})'.format(table, deleted), (project.project_id,))
+        connection.execute('DELETE FROM stories WHERE project_id = ? AND story_id NOT IN (SELECT story_id FROM ordered)',
+                           (project.project_id,))
+        connection.execute('UPDATE stories SET position = (SELECT position FROM ordered WHERE ordered.story_id = '
+                           'stories.story_id) WHERE project_id = ?', (project.project_id,))
+
+    def get_stories(self, project_id, filter_string=''):
+        """Returns the mirrored stories of a project matching the filter, in priority order.
+        The filter is answered in sql, with the same matching as filters.py, or where sql can not match
+        the same way (non-ascii values) evaluated over the project's stories in python
+        """
+        connection = self.connect()
+        try:
+            if _last_synced(connection, project_id) is None:
+                raise NotMirroredError('Project {} has not been synced, run pivotal_tools sync first'.format(project_id))
+
+            try:
+                where, parameters = _filter_to_sql(filter_string)
+                stories = self._select(connection, project_id, where, parameters)
+            except ValueError:
+                # Not expressible in sql, evaluate it over all of the project's stories instead
+                stories = filters.StorySet(self._select(connection, project_id, '', [])).query(filter_string)
+            self._load_children(connection, stories)
+            return stories
+        finally:
+            connection.close()
+
+    def _select(self, connection, project_id, where, parameters):
+        rows = connection.execute('SELECT {} FROM stories WHERE project_id = ? {} ORDER BY position'.format(
+                                      ', '.join(STORY_COLUMNS), where), [project_id] + parameters).fetchall()
+        return [_story_from_row(row) for row in rows]
+
+    def load_story(self, story_id):
+        """returns a single mirrored story, or None if it is not in the mirror"""
+        connection = self.connect()
+        try:
+            row = connection.execute('SELECT {} FROM stories WHERE story_id = ?'.format(', '.join(STORY_COLUMNS)),
+                                     (story_id,)).fetchone()
+            if row is None:
+                return None
+            story = _story_from_row(row)
+            self._load_children(connection, [story])
+            return story
+        finally:
+            connection.close()
+
+    def _delete_project(self, connection, project_id):
+        story_ids = 'SELECT story_id FROM stories WHERE project_id = ?'
+        for table in ['notes', 'tasks', 'attachments', 'labels']:
+            connection.execute('DELETE FROM {} WHERE story_id IN ({})'.format(table, story_ids), (project_id,))
+        connection.execute('DELETE FROM stories WHERE project_id = ?', (project_id,))
+
+    def _write_story(self, connection, story, position):
+        for table in ['notes', 'tasks', 'attachments', 'labels']:
+            connection.execute('DELETE FROM {} WHERE story_id = ?'.format(table), (story.story_id,))
+
+        connection.execute('INSERT OR REPLACE INTO stories (position, {}) VALUES (?, {})'.format(
+                               ', '.join(STORY_COLUMNS), ', '.join('?' * len(STORY_COLUMNS))),
+                           [position] + [getattr(story, column) for column in STORY_COLUMNS])
+        connection.executemany('INSERT INTO notes VALUES (?, ?, ?, ?)',
+                               [(story.story_id, note.note_id, note.text, note.author) for note in story.notes])
+        connection.executemany('INSERT INTO tasks VALUES (?, ?, ?, ?)',
+                               [(story.story_id, task.task_id, task.description, task.complete) for task in story.tasks])
+        connection.executemany('INSERT INTO attachments VALUES (?, ?, ?, ?)',
+                               [(story.story_id, attachment.attachment_id, attachment.description, attachment.url)
+                                for attachment in story.attachments])
+        connection.executemany('INSERT INTO labels VALUES (?, ?)',
+                               [(story.story_id, label) for label in story.labels.split(',') if label])
+
+    def _load_children(self, connection, stories):
+        """fills in the notes, tasks and attachments of the stories, with one query per table"""
+        if len(stories) == 0:
+            return
+        stories_by_id = dict((story.story_id, story) for story in stories)
+        for story in stories:
+            story.notes = []
+            story.tasks = []
+            story.attachments = []
+
+        # sqlite limits the number of parameters in a query, look the children up in batches
+        story_ids = stories_by_id.keys()
+        for start in range(0, len(story_ids), 500):
+            batch = story_ids[start:start + 500]
+            placeholders = ', '.join('?' * len(batch))
+            for row in connection.execute('SELECT * FROM notes WHERE story_id IN ({})'.format(placeholders), batch):
+                stories_by_id[row[0]].notes.append(Note(row[1], row[2], row[3]))
+            for row in connection.execute('SELECT * FROM tasks WHERE story_id IN ({})'.format(placeholders), batch):
+                stories_by_id[row[0]].tasks.append(Task(row[1], row[2], None if row[3] is None else bool(row[3])))
+            for row in connection.execute('SELECT * FROM attachments WHERE story_id IN ({})'.format(placeholders), batch):
+                stories_by_id[row[0]].attachments.append(Attachment(row[1], row[2], row[3]))
+
+
+def _last_synced(connection, project_id):
+    row = connection.execute('SELECT synced_at FROM projects WHERE project_id = ?', (project_id,)).fetchone()
+    return row[0] if row is not None else None
+
+
+def _initials(full_name):
+    if full_name:
+        return ''.join([s[0] for s in full_name.split(' ') if s]).upper()
+    else:
+        return ''
+
+
+def _story_from_row(row):
+    story = Story()
+    for column, value in zip(STORY_COLUMNS, row):
+        setattr(story, column, value)
+    return story
+
+
+def _filter_to_sql(filter_string):
+    """Turns a filter string into an sql condition and its parameters, matching as filters.StorySet does.
+    Raises ValueError if it can not, filters.FilterSyntaxError if the filter is not understood at all
+    """
+    conditions = []
+    parameters = []
+    for term in filters.parse(filter_string):
+        values = term.values
+        if any(isinstance(value, basestring) and not _is_ascii(value) for value in values):
+            # sqlite's LOWER only folds ascii, where python's lower() folds every letter
+            raise ValueError("'{}' can not be answered in sql".format(', '.join(values)))
+        placeholders = ', '.join('?' * len(values))
+        if term.key is None:
+            condition = "(instr(LOWER(COALESCE(name, '')), ?) OR instr(LOWER(COALESCE(description, '')), ?))"
+            values = values * 2
+        elif term.key == 'owner':
+            # Tracker matches owners by name or initials
+            condition = '(LOWER(owned_by) IN ({0}) OR LOWER(initials(owned_by)) IN ({0}))'.format(placeholders)
+            values = values * 2
+        elif term.key == 'label':
+            # One test per term, so several label: terms must all match, each against any of the story's labels
+            condition = ('EXISTS (SELECT 1 FROM labels WHERE labels.story_id = stories.story_id '
+                         'AND LOWER(label) IN ({}))'.format(placeholders))
+        elif term.key in TEXT_FILTER_COLUMNS:
+            condition = 'LOWER({}) IN ({})'.format(FILTER_COLUMNS[term.key], placeholders)
+        else:
+            condition = '{} IN ({})'.format(FILTER_COLUMNS[term.key], placeholders)
+
+        # A missing field matches nothing, so negated it matches
+        condition = 'COALESCE({}, 0)'.format(condition)
+        conditions.append('NOT ' + condition if term.negated else condition)
+        parameters.extend(values)
+
+    if conditions:
+        return 'AND ' + ' AND '.join(conditions), parameters
+    else:
+        return '', parameters
+
+
+def _is_ascii(value):
+    try:
+        value.encode('ascii')
+    except UnicodeError:
+        return False
+    return True
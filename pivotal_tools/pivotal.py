@@ -1,60 +1,347 @@
 # Core Imports
 import os
+import time
+import random
+import threading
 from urllib import quote
-import xml.etree.ElementTree as ET
+from collections import deque, OrderedDict
+from itertools import islice
+from email.utils import parsedate_tz, mktime_tz
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 
-# 3rd Party Imports
-import requests
-import dicttoxml
+# 3rd Party Imports are deferred to the functions that use them (requests, dicttoxml), so the command line
+# starts quickly when it does not need them
+
+# Local Imports
+import cache
+import filters
 
 TOKEN = os.getenv('PIVOTAL_TOKEN', None)
 
+# Tracker API to talk to: 3 for the v3 xml api, 5 for the v5 json api (see json_api.py)
+API_VERSION = os.getenv('PIVOTAL_API_VERSION', '3')
+# Root of the API, defaults to Tracker's own for the version in use
+API_URL = os.getenv('PIVOTAL_API_URL', None)
+
+# HTTP transport settings, shared by every call to the Tracker API
+POOL_SIZE = int(os.getenv('PIVOTAL_POOL_SIZE', 10))
+CONNECT_TIMEOUT = float(os.getenv('PIVOTAL_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.getenv('PIVOTAL_READ_TIMEOUT', 30))
+
+# Filters behind the canned story queries
+UNESTIMATED_FEATURES_FILTER = 'type:feature state:unstarted'
+OPEN_BUGS_FILTER = 'type:bug state:unstarted'
+IN_PROGRESS_FILTER = 'state:started,rejected'
+FINISHED_FEATURES_FILTER = 'state:delivered,finished type:feature'
+FINISHED_BUGS_FILTER = 'state:delivered,finished type:bug'
+KNOWN_ISSUES_FILTER = 'state:unscheduled,unstarted,started,rejected type:bug'
+
+# Every state but accepted.  A snapshot of these stories can answer any of the canned queries above locally
+OPEN_STATES_FILTER = 'state:unscheduled,unstarted,started,finished,delivered,rejected'
+
+# Story attributes list views need, which backends able to select fields ask for when listing stories.
+# Single stories, and listings asked for ALL_FIELDS, come with everything
+LIST_FIELDS = ('story_id', 'project_id', 'name', 'owned_by', 'story_type', 'estimate', 'state', 'url', 'labels')
+ALL_FIELDS = LIST_FIELDS + ('description', 'notes', 'attachments', 'tasks')
+
+# Number of stories requested per page by the paging APIs.  MAX_PAGE_SIZE caps pages sized to a caller's needs
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# Every request goes through one scheduler, which retries throttled, failed and unreachable requests up to
+# MAX_RETRIES times.  Requests are not held back until the server throttles one (429), from then on they are kept
+# to REQUESTS_PER_SECOND on average, in bursts of up to REQUEST_BURST
+REQUESTS_PER_SECOND = float(os.getenv('PIVOTAL_REQUESTS_PER_SECOND', 10))
+REQUEST_BURST = int(os.getenv('PIVOTAL_REQUEST_BURST', 10))
+MAX_RETRIES = int(os.getenv('PIVOTAL_MAX_RETRIES', 4))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+
+# Upper bound on concurrent requests when fanning out over projects
+MAX_WORKERS = int(os.getenv('PIVOTAL_MAX_WORKERS', 8))
+
+# Number of stories prefetch_stories reloads ahead of the one being worked on
+PREFETCH_DEPTH = 3
+
+# On disk map of story id -> project id, so a story can be loaded without searching every project.  It is an
+# append only log of "<story id> <project id>" lines, the last line for a story winning, so recording a page
+# of stories costs a write of that page only.  Once the log is twice STORY_INDEX_LIMIT lines long it is
+# rewritten with the STORY_INDEX_LIMIT stories recorded last
+STORY_INDEX_FILE = 'story_index.log'
+STORY_INDEX_LIMIT = int(os.getenv('PIVOTAL_STORY_INDEX_LIMIT', 20000))
+
+# On disk copy of the project list, which rarely changes.  Refetched once it is older than PROJECTS_TTL seconds
+PROJECTS_FILE = 'projects.json'
+PROJECTS_TTL = int(os.getenv('PIVOTAL_PROJECTS_TTL', 24 * 60 * 60))
+
+# Story query responses are kept on disk with their ETag / Last-Modified validators, so repeated queries
+# can be revalidated with a conditional request instead of downloaded again.  Each time one is written, those
+# unused for RESPONSE_CACHE_TTL seconds are removed, then the least recently used past RESPONSE_CACHE_SIZE bytes
+RESPONSE_CACHE_DIR = 'responses'
+RESPONSE_CACHE_SIZE = int(os.getenv('PIVOTAL_RESPONSE_CACHE_SIZE', 50 * 1024 * 1024))
+RESPONSE_CACHE_TTL = int(os.getenv('PIVOTAL_RESPONSE_CACHE_TTL', 7 * 24 * 60 * 60))
+
+# Seconds a response this process has already parsed is reused without asking the server again.  0, the
+# default, revalidates every query and keeps no parsed responses; the daemon (see daemon.py) raises it, and
+# keeps the queries in use fresh.  Like the on disk cache, the parsed responses kept are limited to those of
+# the most recently used RESPONSE_CACHE_SIZE bytes of responses
+RESPONSE_MAX_AGE = 0
+
+_session = None
+_scheduler = None
+_backend = None
+# Guards creating the session, scheduler, backend and mirrors, which may first be needed in several threads at once
+_shared_lock = threading.Lock()
+_mirrors = {}
+_projects = None
+# Least recently used first
+_parsed_responses = OrderedDict()
+_parsed_responses_size = 0
+_parsed_responses_lock = threading.Lock()
+# Set while refresh_responses fetches responses again, so refreshing one does not count as using it
+_refreshing = threading.local()
+_story_index = None
+_story_index_lines = 0
+_story_index_lock = threading.Lock()
+_request_hooks = []
+_changes_sent = 0
+_changes_sent_lock = threading.Lock()
+
 
 def find_project_for_story(story_id):
-    """If we have multiple projects, will loop through the projects to find the one with the given story.
+    """If we have multiple projects, will search the projects to find the one with the given story.
     returns None if not found
     """
 
-    for project in Project.all():
-        story = project.load_story(story_id)
-        if story is not None:
-            return project
+    project, story = _find_story_in_projects(story_id)
+    return project
+
+
+def _find_story_in_projects(story_id):
+    """Looks the story up in every project at once, on a bounded pool of workers.
+    Returns a (project, story) tuple for the first project that has it, or (None, None) if none do.
+    Lookups still in flight once the story is found are ignored, and those not yet started are skipped.
+    """
+
+    from multiprocessing.pool import ThreadPool
+
+    projects = Project.all()
+    if len(projects) == 0:
+        return None, None
+
+    found = threading.Event()
+
+    def lookup(project):
+        if found.is_set():
+            return project, None
+        return project, project.load_story(story_id)
+
+    pool = ThreadPool(min(MAX_WORKERS, len(projects)))
+    try:
+        for project, story in pool.imap_unordered(lookup, projects):
+            if story is not None:
+                found.set()
+                return project, story
+    finally:
+        # As in concurrent_map, the threads wind down on their own, terminate() would poll for a tenth of a second
+        pool.close()
 
     #Not found
     print "No project found for story: #{}".format(story_id)
-    return None
+    return None, None
 
 
 def get_project_by_index(index):
     return Project.all()[index]
 
 
+def transition_stories(stories, transition):
+    """Applies a transition ('start', 'finish', 'deliver', 'accept' or 'reject') to many stories at once.
+    Returns a list of (story, error) tuples in the order given, error is None if the transition succeeded
+    """
+    import requests
+
+    def apply_transition(story):
+        try:
+            getattr(story, transition)()
+            return story, None
+        except (InvalidStateException, requests.exceptions.RequestException), e:
+            return story, e
+
+    return concurrent_map(apply_transition, stories)
+
+
+def _load_story_index():
+    global _story_index, _story_index_lines
+    if _story_index is None:
+        lines = cache.read_lines(STORY_INDEX_FILE)
+        _story_index = {}
+        for story_id, project_id in _read_story_index(lines):
+            if project_id == '-':
+                _story_index.pop(story_id, None)
+            else:
+                _story_index[story_id] = project_id
+        _story_index_lines = len(lines)
+    return _story_index
+
+
+def _read_story_index(lines):
+    """yields the (story id, project id) pairs of index lines, in order.  A project id of - forgets the story"""
+    for line in lines:
+        fields = line.split()
+        # Anything else is a line cut short by a process that died writing it
+        if len(fields) == 2:
+            yield fields[0], fields[1]
+
+
+def lookup_story_project(story_id):
+    """returns the project id the story was last seen in, or None if we have never seen it"""
+    with _story_index_lock:
+        return _load_story_index().get(str(story_id))
+
+
+def index_stories(stories):
+    """records which project each of the given stories belongs to"""
+    _index_story_ids([(story.story_id, story.project_id) for story in stories])
+
+
+def _index_story_ids(story_ids):
+    """records a list of (story id, project id) pairs in the story index"""
+    with _story_index_lock:
+        index = _load_story_index()
+        lines = []
+        for story_id, project_id in story_ids:
+            if story_id and project_id and index.get(story_id) != project_id:
+                index[story_id] = project_id
+                lines.append('{} {}\n'.format(story_id, project_id))
+        _append_story_index(lines)
+
+
+def forget_story(story_id):
+    """drops a stale entry from the story index"""
+    with _story_index_lock:
+        index = _load_story_index()
+        if index.pop(str(story_id), None) is not None:
+            _append_story_index(['{} -\n'.format(story_id)])
+
+
+def _append_story_index(lines):
+    global _story_index, _story_index_lines
+    if not lines:
+        return
+    cache.append_lines(STORY_INDEX_FILE, lines)
+    _story_index_lines += len(lines)
+    if _story_index_lines < 2 * STORY_INDEX_LIMIT:
+        return
+
+    # Keep the stories recorded last, read back from the log as other processes may have added to it
+    seen = set()
+    latest = []
+    for story_id, project_id in reversed(list(_read_story_index(cache.read_lines(STORY_INDEX_FILE)))):
+        if story_id not in seen:
+            seen.add(story_id)
+            if project_id != '-':
+                latest.append((story_id, project_id))
+            if len(seen) == STORY_INDEX_LIMIT:
+                break
+    latest.reverse()
+    _story_index = dict(latest)
+    _story_index_lines = len(latest)
+    cache.write_lines(STORY_INDEX_FILE, ['{} {}\n'.format(story_id, project_id) for story_id, project_id in latest])
+
+
+class RequestEvent(object):
+    """What one call to the Tracker API cost, passed to the functions registered with add_request_hook.
+
+    latency is the time to the response headers, bytes the size of the (decoded) body, and parse_time the
+    time spent turning the body into models.  For streamed story listings parse_time also covers reading
+    the body, as the two are interleaved.  A response answered from the cache has a status of 304
+    """
+    __slots__ = ('method', 'url', 'status', 'bytes', 'latency', 'parse_time', 'story_count')
+
+    def __init__(self, method, url, status, bytes, latency, parse_time=0.0, story_count=0):
+        self.method = method
+        self.url = url
+        self.status = status
+        self.bytes = bytes
+        self.latency = latency
+        self.parse_time = parse_time
+        self.story_count = story_count
+
+
+def add_request_hook(hook):
+    """Calls hook(event) with a RequestEvent after every API call, once its response has been parsed.
+    Hooks are called from whichever thread made the call, and must not raise
+    """
+    _request_hooks.append(hook)
+
+
+def remove_request_hook(hook):
+    if hook in _request_hooks:
+        _request_hooks.remove(hook)
+
+
+def _report_request(response, parse_time=0.0, story_count=0, size=None):
+    if not _request_hooks:
+        return
+    event = RequestEvent(response.request.method, response.url, response.status_code,
+                         len(response.content) if size is None else size,
+                         response.elapsed.total_seconds(), parse_time, story_count)
+    for hook in list(_request_hooks):
+        hook(event)
+
+
 class Note(object):
     """object representation of a Pivotal Note, should be accessed from story.notes"""
+    __slots__ = ('note_id', 'text', 'author')
+
     def __init__(self, note_id, text, author):
         self.note_id = note_id
         self.text = text
         self.author = author
 
+    @classmethod
+    def from_node(cls, node):
+        return Note(**_decode_element(node, NOTE_ELEMENTS, NOTE_DEFAULTS))
+
 
 class Task(object):
     """object representation of a Pivotal Task, should be accessed from story.tasks"""
+    __slots__ = ('task_id', 'description', 'complete')
+
     def __init__(self, task_id, description, complete):
         self.task_id = task_id
         self.description = description
         self.complete = complete
 
+    @classmethod
+    def from_node(cls, node):
+        return Task(**_decode_element(node, TASK_ELEMENTS, TASK_DEFAULTS))
+
 
 class Attachment(object):
     """object representation of a Pivotal attachment, should be accessed from story.attachments"""
+    __slots__ = ('attachment_id', 'description', 'url')
+
     def __init__(self, attachment_id, description, url):
         self.attachment_id = attachment_id
         self.description = description
         self.url = url
 
+    @classmethod
+    def from_node(cls, node):
+        return Attachment(**_decode_element(node, ATTACHMENT_ELEMENTS, ATTACHMENT_DEFAULTS))
+
 
 class Story(object):
     """object representation of a Pivotal story"""
+    __slots__ = ('story_id', 'project_id', 'name', 'description', 'owned_by', 'story_type', 'estimate', 'state',
+                 'url', 'labels', 'notes', 'attachments', 'tasks')
+
     def __init__(self):
         self.story_id = None
         self.project_id = None
@@ -70,7 +357,6 @@ class Story(object):
         self.attachments = []
         self.tasks = []
 
-
     @property
     def first_label(self):
         """returns the first label if any from labels.  Used for grouping"""
@@ -79,73 +365,105 @@ class Story(object):
 
     @classmethod
     def find(cls, story_id, project_index=None):
-        project = None
+        """Loads a story, checking the story index first so a known story costs a single request.
+        A stale index entry falls back to searching the projects, which repairs the entry
+        """
+        project_id = lookup_story_project(story_id)
+        if project_id is not None:
+            story = Project(project_id, None, None).load_story(story_id)
+            if story is not None:
+                return story
+            forget_story(story_id)
+
         if project_index is None:
-            project = find_project_for_story(story_id)
+            project, story = _find_story_in_projects(story_id)
+            return story
 
-        else:
-            project = Project.all()[project_index]
-
-        if project is not None:
-            return project.load_story(story_id)
-        else:
-            return None
+        project = Project.all()[project_index]
+        return project.load_story(story_id)
 
+    @classmethod
+    def find_many(cls, story_ids, project_index=None):
+        """Loads several stories at once.  Returns a dict of story id -> (story, error): story is None if it was
+        not found, and error the exception that stopped it being looked up, if any.
 
+        Stories in the story index are loaded from their project concurrently.  The rest are then looked for
+        all at once, with one id: query per project and the projects queried concurrently
+        """
+        projects = Project.all()
+        if project_index is not None:
+            projects = [projects[project_index]]
+        # Each story is looked up once, however many times it is asked for
+        story_ids = list(OrderedDict.fromkeys(story_ids))
+
+        def load_indexed(story_id):
+            project_id = lookup_story_project(story_id)
+            if project_id is None:
+                return None, None
+            try:
+                story = Project(project_id, None, None).load_story(story_id)
+            except Exception, e:
+                return None, e
+            if story is None:
+                # Moved or deleted, searched for below
+                forget_story(story_id)
+            return story, None
+
+        found = dict(zip(story_ids, concurrent_map(load_indexed, story_ids)))
+
+        # Tracker ids are numbers, anything else can not be found
+        missing = [story_id for story_id in story_ids if found[story_id] == (None, None) and story_id.isdigit()]
+        if not missing:
+            return found
+
+        query = 'id:{} includedone:true'.format(','.join(missing))
+
+        def search(project):
+            try:
+                return project.get_stories(query), None
+            except Exception, e:
+                return [], e
+
+        located = {}
+        errors = []
+        for stories, error in concurrent_map(search, projects):
+            located.update((story.story_id, story) for story in stories)
+            if error is not None:
+                errors.append(error)
+
+        for story_id in missing:
+            if story_id in located:
+                found[story_id] = located[story_id], None
+            elif errors:
+                # It may be in a project that could not be searched
+                found[story_id] = None, errors[0]
+        return found
 
     @classmethod
     def from_node(cls, node):
-        """instantiates a Story object from an elementTree node, build child notes and attachment lists"""
-
-        story = Story()
-        story.story_id = _parse_text(node, 'id')
-        story.name = _parse_text(node, 'name')
-        story.owned_by = _parse_text(node, 'owned_by')
-        story.story_type = _parse_text(node, 'story_type')
-        story.state = _parse_text(node, 'current_state')
-        story.description = _parse_text(node, 'description')
-        story.estimate = _parse_int(node, 'estimate')
-        story.labels = _parse_text(node, 'labels')
-        story.url = _parse_text(node, 'url')
-        story.project_id = _parse_text(node, 'project_id')
-
-        note_nodes = node.find('notes')
-        if note_nodes is not None:
-            for note_node in note_nodes:
-                note_id = _parse_text(note_node, 'id')
-                text = _parse_text(note_node, 'text')
-                author = _parse_text(note_node, 'author')
-                story.notes.append(Note(note_id, text, author))
-
-        attachment_nodes = node.find('attachments')
-        if attachment_nodes is not None:
-            for attachment_node in attachment_nodes:
-                attachment_id = _parse_text(attachment_node, 'id')
-                description = _parse_text(attachment_node, 'text')
-                url = _parse_text(attachment_node, 'url')
-                story.attachments.append(Attachment(attachment_id,description,url))
-
-        task_nodes = node.find('tasks')
-        if task_nodes is not None:
-            for task_node in task_nodes:
-                task_id = _parse_text(task_node, 'id')
-                description = _parse_text(task_node, 'description')
-                complete = _parse_boolean(task_node, 'complete')
-                story.tasks.append(Task(task_id, description, complete))
-
-
-
+        """instantiates a Story object from an elementTree node, in a single pass over its children.
+        The notes, attachments and tasks are built here rather than kept as elements, which would hold on to
+        several times the memory for as long as the story is kept
+        """
+        values = _decode_element(node, STORY_ELEMENTS, STORY_DEFAULTS)
+        # Every attribute is set here, running __init__ would only set them twice
+        story = Story.__new__(Story)
+        for attribute, value in values.iteritems():
+            setattr(story, attribute, value)
+        for attribute in ('notes', 'attachments', 'tasks'):
+            if attribute not in values:
+                setattr(story, attribute, [])
         return story
 
     def assign_estimate(self, estimate):
         """changes the estimate of a story"""
-        update_story_url ="https://www.pivotaltracker.com/services/v3/projects/{}/stories/{}?story[estimate]={}".format(self.project_id, self.story_id, estimate)
-        response = _perform_pivotal_put(update_story_url)
+        url, data, headers = get_backend().update_story_request(self.project_id, self.story_id, 'estimate', estimate)
+        response = _perform_pivotal_put(url, data, headers)
 
     def set_state(self, state):
         """changes the estimate of a story"""
-        update_story_url ="https://www.pivotaltracker.com/services/v3/projects/{}/stories/{}?story[current_state]={}".format(self.project_id, self.story_id, state)
-        response = _perform_pivotal_put(update_story_url)
+        url, data, headers = get_backend().update_story_request(self.project_id, self.story_id, 'current_state', state)
+        response = _perform_pivotal_put(url, data, headers)
         return response
 
     def finish(self):
@@ -172,6 +490,31 @@ class Story(object):
 
 class InvalidStateException(Exception): pass
 
+
+class RateLimiter(object):
+    """Token bucket, allows `rate` calls per second on average, in bursts of up to `burst` calls"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """blocks until a call is allowed"""
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
 class Project(object):
     """object representation of a Pivotal Project"""
 
@@ -179,145 +522,864 @@ class Project(object):
         self.project_id = project_id
         self.name = name
         self.point_scale = point_scale
+        self.mirror = None
+        self.snapshot = None
+        self.snapshot_states = None
+        self.snapshot_types = None
+        self.snapshot_fields = None
+
+    def use_mirror(self, mirror=None):
+        """Reads stories from a local mirror (see mirror.py) instead of the network from now on.
+        Defaults to the mirror kept in the cache directory
+        """
+        self.mirror = mirror or _default_mirror()
+
+    def sync(self, full=False, mirror=None):
+        """Copies the project's stories into a local mirror, returns the number of stories written.
+        Only stories modified since the last sync are fetched, unless full is set
+        """
+        return (mirror or _default_mirror()).sync(self, full=full)
+
+    def load_snapshot(self, filter_string=OPEN_STATES_FILTER, fields=None):
+        """Fetches the stories matching a broad filter, of states and optionally types, once, and answers
+        later queries that fall within those states and types locally (see filters.py) instead of with a
+        request each
+        """
+        fields = fields or get_backend().list_fields
+        self.snapshot = filters.StorySet(self.get_stories(filter_string, fields=fields))
+        self.snapshot_states = filters.states(filter_string)
+        self.snapshot_types = filters.types(filter_string)
+        self.snapshot_fields = fields
+
+    def _snapshot_query(self, filter_string):
+        """answers a query from the snapshot, returns None if the snapshot can not answer it"""
+        try:
+            query_states = filters.states(filter_string)
+            if query_states is None or not query_states <= self.snapshot_states:
+                return None
+            query_types = filters.types(filter_string)
+            if self.snapshot_types is not None and (query_types is None or not query_types <= self.snapshot_types):
+                return None
+            if 'description' not in self.snapshot_fields and filters.has_text(filter_string):
+                # Free text also matches descriptions, which the snapshot did not fetch
+                return None
+            return self.snapshot.query(filter_string)
+        except filters.FilterSyntaxError:
+            return None
+
+    def get_mirrored_stories(self, filter_string=''):
+        """returns the stories matching the filter from the local mirror, see Mirror.get_stories"""
+        return (self.mirror or _default_mirror()).get_stories(self.project_id, filter_string)
 
     @classmethod
     def from_node(cls, project_node):
-        name = _parse_text(project_node, 'name')
-        id = _parse_text(project_node, 'id')
-        point_scale = _parse_array(project_node, 'point_scale')
-        return Project(id, name, point_scale)
+        return Project(**_decode_element(project_node, PROJECT_ELEMENTS, PROJECT_DEFAULTS))
 
     @classmethod
-    def all(cls):
-        """returns all projects for the given user"""
-        projects_url = 'https://www.pivotaltracker.com/services/v3/projects'
-        response = _perform_pivotal_get(projects_url)
+    def from_dict(cls, project_dict):
+        return Project(project_dict['id'], project_dict['name'], project_dict['point_scale'])
 
-        root = ET.fromstring(response.text)
-        if root is not None:
-            return [Project.from_node(project_node) for project_node in root]
+    def to_dict(self):
+        return {'id': self.project_id, 'name': self.name, 'point_scale': self.point_scale}
+
+    @classmethod
+    def all(cls, refresh=False):
+        """returns all projects for the given user.
+        The list is cached on disk for PROJECTS_TTL seconds, separately for each token and api (url and version).
+        Pass refresh=True to go to the server regardless
+        """
+        global _projects
+        if _projects is not None and not refresh:
+            return _projects
+
+        # The same token may be used against another server, or another version of the api
+        config_key = cache.fingerprint(TOKEN, API_VERSION, API_URL)
+        cached = cache.read_json(PROJECTS_FILE)
+        if not refresh and cached is not None and cached.get('config') == config_key \
+                and time.time() - cached.get('fetched_at', 0) < PROJECTS_TTL:
+            _projects = [Project.from_dict(project_dict) for project_dict in cached['projects']]
+            return _projects
+
+        backend = get_backend()
+        response = _perform_pivotal_get(backend.projects_url())
+
+        started = time.time()
+        projects = backend.parse_projects(response.text)
+        if projects is not None:
+            _projects = projects
+            _report_request(response, time.time() - started)
+            cache.write_json(PROJECTS_FILE, {'config': config_key,
+                                             'fetched_at': time.time(),
+                                             'projects': [project.to_dict() for project in _projects]})
+            return _projects
+
+    @classmethod
+    def clear_cache(cls):
+        """forgets the cached project list, so the next call to all() goes to the server"""
+        global _projects
+        _projects = None
+        cache.remove(PROJECTS_FILE)
+
+    @classmethod
+    def reset_cache(cls, reload=False):
+        """Replaces the project list held in memory with fresh copies, without the mirrors and snapshots set up
+        on the old ones.  With reload=True it is dropped instead, and the next call to all() reads it from disk
+        """
+        global _projects
+        if reload:
+            _projects = None
+        elif _projects is not None:
+            _projects = [Project.from_dict(project.to_dict()) for project in _projects]
 
     @classmethod
     def load_project(cls, project_id):
-        url = "https://www.pivotaltracker.com/services/v3/projects/%s" % project_id
-        response = _perform_pivotal_get(url)
+        backend = get_backend()
+        response = _perform_pivotal_get(backend.project_url(project_id))
+        response.raise_for_status()
 
-        project_node = ET.fromstring(response.text)
-        name = _parse_text(project_node, 'name')
-        return Project(project_id, name)
+        started = time.time()
+        project = backend.parse_project(response.text)
+        _report_request(response, time.time() - started)
+        return project
 
-    def get_stories(self, filter_string):
+    def get_stories(self, filter_string, limit=None, offset=None, fields=None):
         """Given a filter strong, returns an list of stories matching that filter.  If none will return an empty list
         Look at [link](https://www.pivotaltracker.com/help/faq#howcanasearchberefined) for syntax
 
+        Pass limit and offset to fetch a single page of the results.  fields names the Story attributes
+        needed, backends that can select fields default to LIST_FIELDS
         """
+        stories = None
+        if self.snapshot is not None:
+            stories = self._snapshot_query(filter_string)
+        if stories is None and self.mirror is not None:
+            stories = self.mirror.get_stories(self.project_id, filter_string)
+
+        if stories is not None:
+            offset = offset or 0
+            return stories[offset:offset + limit if limit is not None else None]
+
+        backend = get_backend()
+        if limit is None and backend.max_page_size is not None:
+            # The backend pages its listings, collect every page
+            stories = []
+            for page in self.iter_story_pages(filter_string, backend.max_page_size, fields, offset or 0):
+                stories.extend(page)
+            return stories
+
+        return _get_cached_stories(self._stories_url(filter_string, limit, offset, fields))
+
+    def iter_story_pages(self, filter_string, page_size=PAGE_SIZE, fields=None, offset=0):
+        """yields the stories matching the filter a page at a time, as lists of at most page_size stories.
+        The next page is only requested once the previous one has been consumed
+        """
+        while True:
+            page = self.get_stories(filter_string, limit=page_size, offset=offset, fields=fields)
+            if len(page) > 0:
+                yield page
+            if len(page) < page_size:
+                return
+            offset += page_size
+
+    def iter_stories(self, filter_string, page_size=None, fields=None, index=True):
+        """Like get_stories, but yields each story as soon as it has been read off the wire.
+        The response is parsed incrementally, so memory use stays flat however many stories match.
+
+        With a page_size, the stories are requested page_size at a time, and a page is only requested
+        once every story of the previous page has been consumed.  Pass index=False to leave the stories
+        out of the story index, for reads of a whole project that are not followed by story lookups
+        """
+        if self.snapshot is not None or self.mirror is not None:
+            for story in self.get_stories(filter_string, fields=fields):
+                yield story
+            return
+
+        page_size = page_size or get_backend().max_page_size
+        offset = 0
+        while True:
+            count = 0
+            url = self._stories_url(filter_string, page_size, offset, fields)
+            for story in self._stream_stories(url, page_size, index):
+                count += 1
+                yield story
+            if page_size is None or count < page_size:
+                return
+            offset += page_size
+
+    def _stream_stories(self, stories_url, limit=None, index=True):
+        key = cache.fingerprint(TOKEN, stories_url)
+        fresh = _fresh_response(key)
+        if fresh is not None:
+            for story in fresh:
+                yield story
+            return
+
+        # Streamed stories are only kept when responses are reused, otherwise memory use would grow with them
+        kept = [] if RESPONSE_MAX_AGE > 0 else None
+
+        def remember():
+            _remember_response(key, kept, lambda: _get_cached_stories(stories_url, max_age=0), size=body.count)
+
+        response = _perform_pivotal_get(stories_url, stream=True)
+        response.raise_for_status()
+        response.raw.decode_content = True
+        body = _CountingReader(response.raw)
+
+        stories = get_backend().iter_stories(body)
+        story_ids = []
+        count = 0
+        parse_time = 0.0
+        try:
+            while True:
+                started = time.time()
+                try:
+                    story = next(stories)
+                except StopIteration:
+                    break
+                finally:
+                    parse_time += time.time() - started
+                count += 1
+                if index:
+                    story_ids.append((story.story_id, story.project_id))
+                if kept is not None:
+                    kept.append(story)
+                    if len(kept) == limit:
+                        # A full page, kept now as callers often stop reading once they have it
+                        remember()
+                yield story
+            if kept is not None and len(kept) != limit:
+                remember()
+        finally:
+            response.close()
+            _index_story_ids(story_ids)
+            _report_request(response, parse_time, count, size=body.count)
+
+    def _stories_url(self, filter_string, limit=None, offset=None, fields=None):
+        backend = get_backend()
+        return backend.stories_url(self.project_id, filter_string, limit, offset, fields or backend.list_fields)
+
+    def load_story(self, story_id, max_age=None):
+        """Trys to find a story, returns None is not found.
+        A story this process loaded less than max_age (default RESPONSE_MAX_AGE) seconds ago is returned as is
+        """
+        if self.mirror is not None:
+            story = self.mirror.load_story(story_id)
+            if story is not None and story.project_id == self.project_id:
+                return story
+            return None
 
-        story_filter = quote(filter_string, safe='')
-        stories_url = "https://www.pivotaltracker.com/services/v3/projects/{}/stories?filter={}".format(self.project_id, story_filter)
-
-        response = _perform_pivotal_get(stories_url)
-        stories_root = ET.fromstring(response.text)
-
-        return [Story.from_node(story_node) for story_node in stories_root]
-
-    def load_story(self, story_id):
-        """Trys to find a story, returns None is not found"""
-        story_url = "https://www.pivotaltracker.com/services/v3/projects/{}/stories/{}".format(self.project_id, story_id)
+        backend = get_backend()
+        url = backend.story_url(self.project_id, story_id)
+        key = cache.fingerprint(TOKEN, url)
+        story = _fresh_response(key, max_age)
+        if story is not None:
+            return story
 
-        resposne = _perform_pivotal_get(story_url)
+        resposne = _perform_pivotal_get(url)
         # print resposne.text
         if resposne.status_code == 404:
             # Not Found
+            _report_request(resposne)
             return None
         else:
             #Found, parsing story
-            root = ET.fromstring(resposne.text)
-            return Story.from_node(root)
+            started = time.time()
+            story = backend.parse_story(resposne.text)
+            _report_request(resposne, time.time() - started, 1)
+            index_stories([story])
+            if RESPONSE_MAX_AGE > 0:
+                _remember_response(key, story, lambda: self.load_story(story_id, max_age=0),
+                                   size=len(resposne.content))
+            return story
 
     def create_story(self,story_dict):
-        stories_url = "https://www.pivotaltracker.com/services/v3/projects/{}/stories".format(self.project_id)
-        story_xml = dicttoxml.dicttoxml(story_dict, root=False)
-        _perform_pivotal_post(stories_url, story_xml)
+        url, data, headers = get_backend().create_story_request(self.project_id, story_dict)
+        _perform_pivotal_post(url, data, headers)
+
+    def get_stories_for_filters(self, filters):
+        """Runs several story queries at once.  filters is a dict mapping a name to a filter string,
+        returns a dict mapping each name to the list of stories matching its filter
+        """
+        names = list(filters)
+        results = concurrent_map(lambda name: self.get_stories(filters[name]), names)
+        return dict(zip(names, results))
+
+    def prefetch_stories(self, stories, depth=PREFETCH_DEPTH):
+        """yields an up to date copy of each of the given stories, reloading the next few stories in the
+        background while the caller works on the current one.  Stories that have since been deleted are skipped
+        """
+        from multiprocessing.pool import ThreadPool
+
+        stories = iter(stories)
+        pool = ThreadPool(depth)
+        pending = deque()
+
+        def load_next(count):
+            for story in islice(stories, count):
+                pending.append(pool.apply_async(self.load_story, (story.story_id,)))
+
+        try:
+            load_next(depth)
+            while pending:
+                result = pending.popleft()
+                load_next(1)
+                story = result.get()
+                if story is not None:
+                    yield story
+        finally:
+            pool.terminate()
 
     def unestimated_stories(self):
-        stories = self.get_stories('type:feature state:unstarted')
-        return self.open_bugs() + [story for story in stories if int(story.estimate) == -1]
+        results = self.get_stories_for_filters({'features': UNESTIMATED_FEATURES_FILTER, 'bugs': OPEN_BUGS_FILTER})
+        return results['bugs'] + [story for story in results['features'] if int(story.estimate) == -1]
 
     def open_bugs(self):
-        return self.get_stories('type:bug state:unstarted')
+        return self.get_stories(OPEN_BUGS_FILTER)
 
     def in_progress_stories(self):
-        return self.get_stories('state:started,rejected')
+        return self.get_stories(IN_PROGRESS_FILTER)
 
     def finished_features(self):
-        return self.get_stories('state:delivered,finished type:feature')
+        return self.get_stories(FINISHED_FEATURES_FILTER)
 
     def finished_bugs(self):
-        return self.get_stories('state:delivered,finished type:bug')
+        return self.get_stories(FINISHED_BUGS_FILTER)
 
     def known_issues(self):
-        return self.get_stories('state:unscheduled,unstarted,started,rejected type:bug')
+        return self.get_stories(KNOWN_ISSUES_FILTER)
+
+
+def _default_mirror():
+    """returns the Mirror in the cache directory, shared so its schema is only created once"""
+    from mirror import Mirror, MIRROR_FILE
+    path = cache.cache_path(MIRROR_FILE)
+    mirror = _mirrors.get(path)
+    if mirror is None:
+        with _shared_lock:
+            mirror = _mirrors.get(path)
+            if mirror is None:
+                mirror = _mirrors[path] = Mirror(path)
+    return mirror
+
+
+def concurrent_map(func, items, workers=None):
+    """calls func on each item on a bounded pool of threads, and returns the results in order"""
+    items = list(items)
+    if len(items) <= 1:
+        return [func(item) for item in items]
+
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(workers or MAX_WORKERS, len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        # Every item is done by now.  The pool's threads wind down on their own, waiting for them with
+        # terminate() or join() costs a tenth of a second polling for no benefit
+        pool.close()
+
+
+def get_session():
+    """returns the shared requests Session, creating it on first use.
+    The session keeps connections alive in a pool so consecutive calls skip the TCP and TLS handshakes
+    """
+    global _session
+    if _session is None:
+        with _shared_lock:
+            if _session is None:
+                import requests
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update({'X-TrackerToken': TOKEN,
+                                        'Accept-Encoding': 'gzip, deflate',
+                                        'Connection': 'keep-alive'})
+                _session = session
+    return _session
+
+
+def get_backend():
+    """returns the backend for the API_VERSION in use, creating it on first use"""
+    global _backend
+    if _backend is None:
+        with _shared_lock:
+            if _backend is None:
+                if API_VERSION == '5':
+                    from json_api import JsonBackend
+                    _backend = JsonBackend()
+                else:
+                    _backend = XmlBackend()
+    return _backend
+
+
+def set_backend(backend):
+    """talks to Tracker through the given backend from now on, see XmlBackend for what a backend provides"""
+    global _backend
+    _backend = backend
+
+
+class XmlBackend(object):
+    """Builds requests for, and decodes responses from, the v3 xml API.
+
+    A backend provides the urls and payloads for each call pivotal.py makes, and decodes the responses
+    into Story and Project objects.  v3 always sends every field of a story, so fields are ignored
+    """
+    default_url = 'https://www.pivotaltracker.com/services/v3'
+    list_fields = ALL_FIELDS
+    selects_fields = False
+    # v3 returns every matching story unless asked for a page
+    max_page_size = None
+
+    def url(self, path):
+        return (API_URL or self.default_url) + path
+
+    def projects_url(self):
+        return self.url('/projects')
+
+    def parse_projects(self, body):
+        root = ET.fromstring(body)
+        if root is not None:
+            return [Project.from_node(project_node) for project_node in root]
+
+    def project_url(self, project_id):
+        return self.url('/projects/{}'.format(project_id))
 
+    def parse_project(self, body):
+        return Project.from_node(ET.fromstring(body))
 
-# TODO Handle requests.exceptions.ConnectionError
+    def stories_url(self, project_id, filter_string, limit=None, offset=None, fields=None):
+        story_filter = quote(filter_string, safe='')
+        stories_url = self.url("/projects/{}/stories?filter={}".format(project_id, story_filter))
+        if limit is not None:
+            stories_url += "&limit={}".format(limit)
+        if offset:
+            stories_url += "&offset={}".format(offset)
+        return stories_url
+
+    def parse_stories(self, body):
+        return [Story.from_node(story_node) for story_node in ET.fromstring(body)]
+
+    def iter_stories(self, stream):
+        return _iterparse_stories(stream)
+
+    def story_url(self, project_id, story_id):
+        return self.url("/projects/{}/stories/{}".format(project_id, story_id))
+
+    def parse_story(self, body):
+        return Story.from_node(ET.fromstring(body))
+
+    def update_story_request(self, project_id, story_id, field, value):
+        """returns the (url, body, headers) of a PUT setting one field of a story"""
+        url = self.url("/projects/{}/stories/{}?story[{}]={}".format(project_id, story_id, field, value))
+        return url, None, {'Content-Length': '0'}
+
+    def create_story_request(self, project_id, story_dict):
+        """returns the (url, body, headers) of a POST creating a story"""
+        import dicttoxml
+        story_xml = dicttoxml.dicttoxml(story_dict, root=False)
+        return self.url("/projects/{}/stories".format(project_id)), story_xml, {'Content-type': "application/xml"}
 
-def _perform_pivotal_get(url):
-    headers = {'X-TrackerToken': TOKEN}
+    def modified_since(self, date):
+        """the filter term for stories modified since a date"""
+        return 'modified_since:{}/{}/{}'.format(date.month, date.day, date.year)
+
+
+def get_scheduler():
+    """returns the shared RequestScheduler, creating it on first use"""
+    global _scheduler
+    if _scheduler is None:
+        with _shared_lock:
+            if _scheduler is None:
+                _scheduler = RequestScheduler(REQUESTS_PER_SECOND, REQUEST_BURST, MAX_RETRIES)
+    return _scheduler
+
+
+class RequestScheduler(object):
+    """Sends requests through the shared session, retrying throttled (429), failed (5xx) and unreachable
+    requests with jittered exponential backoff.  Once the server has throttled a request, every later one is
+    sent under the rate limit, and a Retry-After holds back every thread using the scheduler, not just the
+    one that was throttled.
+
+    POSTs are only retried on 429, as any other failure may have happened after the story was created
+    """
+
+    def __init__(self, rate, burst, max_retries):
+        self.limiter = RateLimiter(rate, burst)
+        self.max_retries = max_retries
+        self.throttled = False
+        self.resume_at = 0
+        self.lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        import requests
+        kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+        retry_statuses = RETRY_STATUSES if method != 'POST' else (429,)
+
+        attempt = 0
+        while True:
+            self._wait_turn()
+            try:
+                response = get_session().request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if method == 'POST' or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                if response.status_code == 429:
+                    self.throttled = True
+                if response.status_code not in retry_statuses or attempt >= self.max_retries:
+                    return response
+                delay = _retry_after(response)
+                if delay is not None:
+                    self._hold(delay)
+                else:
+                    delay = self._backoff(attempt)
+                response.close()
+
+            time.sleep(delay)
+            attempt += 1
+
+    def _wait_turn(self):
+        with self.lock:
+            wait = self.resume_at - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        if self.throttled:
+            self.limiter.acquire()
+
+    def _hold(self, delay):
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.time() + delay)
+
+    def _backoff(self, attempt):
+        """full jitter: a random delay up to an exponentially growing cap"""
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def _retry_after(response):
+    """the delay asked for by a Retry-After header in seconds, or None"""
+    retry_after = response.headers.get('Retry-After')
+    if retry_after is None:
+        return None
+    if retry_after.strip().isdigit():
+        return min(BACKOFF_MAX, int(retry_after))
+
+    parsed = parsedate_tz(retry_after)
+    if parsed is None:
+        return None
+    return min(BACKOFF_MAX, max(0, mktime_tz(parsed) - time.time()))
+
+
+def _perform_pivotal_get(url, headers=None, stream=False):
+    """GETs a url, raising requests.HTTPError for error responses other than 404 (story not found)"""
     # print url
-    response = requests.get(url, headers=headers)
+    response = get_scheduler().request('GET', url, headers=headers, stream=stream)
+    if response.status_code >= 400 and response.status_code != 404:
+        response.raise_for_status()
     return response
 
 
-def _perform_pivotal_put(url):
-    headers = {'X-TrackerToken': TOKEN, 'Content-Length': 0}
-    response = requests.put(url, headers=headers)
+def changes_sent():
+    """the number of PUTs and POSTs this process has sent, whether or not they succeeded"""
+    return _changes_sent
+
+
+def _count_change():
+    global _changes_sent
+    with _changes_sent_lock:
+        _changes_sent += 1
+
+
+def _perform_pivotal_put(url, data=None, headers=None):
+    _count_change()
+    response = get_scheduler().request('PUT', url, data=data, headers=headers)
+    _report_request(response)
+    expire_responses()
     response.raise_for_status()
     return response
 
-def _perform_pivotal_post(url,payload_xml):
-    headers = {'X-TrackerToken': TOKEN, 'Content-type': "application/xml"}
-    response = requests.post(url, data=payload_xml, headers=headers)
+def _perform_pivotal_post(url, payload, headers=None):
+    _count_change()
+    response = get_scheduler().request('POST', url, data=payload, headers=headers)
+    _report_request(response)
+    expire_responses()
     response.raise_for_status()
     return response
 
 
-def _parse_text(node, key):
-    """parses test from an ElementTree node, if not found returns empty string"""
-    element = node.find(key)
-    if element is not None:
-        text = element.text
-        if text is not None:
-            return text.strip()
-        else:
-            return ''
-    else:
-        return ''
-
+def _get_cached_stories(url, max_age=None):
+    """GETs a list of stories, revalidating any copy cached by an earlier run.
+    On a 304 the cached body is reused, and so are the parsed stories if this process already parsed it.
+    Stories this process parsed less than max_age (default RESPONSE_MAX_AGE) seconds ago are returned as is
+    """
+    key = cache.fingerprint(TOKEN, url)
+    fresh = _fresh_response(key, max_age)
+    if fresh is not None:
+        return list(fresh)
+
+    cache_name = os.path.join(RESPONSE_CACHE_DIR, key + '.json')
+    entry = cache.read_json(cache_name)
+
+    headers = {}
+    if entry is not None:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    response = _perform_pivotal_get(url, headers=headers)
+    response.raise_for_status()
 
-def _parse_int(node, key):
-    """parses an int from an ElementTree node, if not found returns None"""
-    element = node.find(key)
-    if element is not None:
-        return int(element.text)
+    if response.status_code == 304 and entry is not None:
+        body = entry['body']
+        cache.touch(cache_name)
     else:
+        body = response.text
+        entry = {'etag': response.headers.get('ETag'),
+                 'last_modified': response.headers.get('Last-Modified'),
+                 'body': body}
+        if response.ok and (entry['etag'] or entry['last_modified']):
+            cache.write_json(cache_name, entry)
+            cache.prune(RESPONSE_CACHE_DIR, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+
+    validator = (entry.get('etag'), entry.get('last_modified'))
+    has_validator = validator != (None, None)
+    if has_validator:
+        parsed = _recall_response(key)
+        if parsed is not None and parsed.validator == validator:
+            parsed.fetched_at = time.time()
+            _report_request(response, story_count=len(parsed.value))
+            return list(parsed.value)
+
+    started = time.time()
+    stories = get_backend().parse_stories(body)
+    _report_request(response, time.time() - started, len(stories))
+    index_stories(stories)
+    if has_validator and RESPONSE_MAX_AGE > 0:
+        _remember_response(key, stories, lambda: _get_cached_stories(url, max_age=0), validator, len(body))
+    return list(stories)
+
+
+class _ParsedResponse(object):
+    """a response this process has parsed, kept so it can be reused, and refreshed, without parsing it again"""
+    __slots__ = ('value', 'validator', 'refresh', 'size', 'fetched_at', 'used_at')
+
+    def __init__(self, value, validator, refresh, size):
+        self.value = value
+        self.validator = validator
+        self.refresh = refresh
+        self.size = size
+        self.fetched_at = self.used_at = time.time()
+
+
+def _remember_response(key, value, refresh, validator=None, size=0):
+    """Keeps a parsed response of size bytes, refresh() fetches it again.  The least recently used responses
+    are forgotten once those kept add up to more than RESPONSE_CACHE_SIZE bytes
+    """
+    global _parsed_responses_size
+    parsed = _ParsedResponse(value, validator, refresh, size)
+    refreshing = getattr(_refreshing, 'active', False)
+    with _parsed_responses_lock:
+        previous = _parsed_responses.get(key)
+        if previous is not None:
+            _parsed_responses_size -= previous.size
+            if refreshing:
+                # Refreshing is not using, the response keeps its place
+                parsed.used_at = previous.used_at
+            else:
+                del _parsed_responses[key]
+        _parsed_responses[key] = parsed
+        _parsed_responses_size += size
+
+        while _parsed_responses_size > RESPONSE_CACHE_SIZE and len(_parsed_responses) > 1:
+            _, oldest = _parsed_responses.popitem(last=False)
+            _parsed_responses_size -= oldest.size
+
+
+def _recall_response(key, max_age=None):
+    """returns the _ParsedResponse kept for the key, or None.
+    Given a max_age (in seconds) only a response fetched within it is returned
+    """
+    with _parsed_responses_lock:
+        parsed = _parsed_responses.get(key)
+        if parsed is None or (max_age is not None and time.time() - parsed.fetched_at >= max_age):
+            return None
+        if not getattr(_refreshing, 'active', False):
+            parsed.used_at = time.time()
+            # Most recently used last
+            del _parsed_responses[key]
+            _parsed_responses[key] = parsed
+    return parsed
+
+
+def _fresh_response(key, max_age=None):
+    """the value of a response parsed within max_age seconds (default RESPONSE_MAX_AGE), or None"""
+    max_age = RESPONSE_MAX_AGE if max_age is None else max_age
+    if max_age <= 0:
         return None
+    parsed = _recall_response(key, max_age)
+    return parsed.value if parsed is not None else None
 
 
-def _parse_array(node, key):
-    """parses an int from an ElementTree node, if not found returns None"""
-    element = node.find(key)
-    if element is not None:
-        return element.text.split(',')
-    else:
-        return None
+def response_count():
+    """the number of parsed responses kept for reuse"""
+    with _parsed_responses_lock:
+        return len(_parsed_responses)
+
+
+def expire_responses():
+    """Stops reusing parsed responses without revalidating them first, after a change to the stories they hold.
+    They are still reused when the server answers that they have not changed
+    """
+    with _parsed_responses_lock:
+        for parsed in _parsed_responses.itervalues():
+            parsed.fetched_at = 0
 
-def _parse_boolean(node, key):
-    """parses an boolean from an ElementTree node, if not found returns None"""
-    element = node.find(key)
-    if element is not None:
-        if element.text == 'true':
-            return True
+
+def refresh_responses(used_within):
+    """Fetches the parsed responses used in the last used_within seconds again, and forgets the rest.
+    Returns the number refreshed
+    """
+    global _parsed_responses_size
+    now = time.time()
+    with _parsed_responses_lock:
+        for key, parsed in _parsed_responses.items():
+            if now - parsed.used_at > used_within:
+                del _parsed_responses[key]
+                _parsed_responses_size -= parsed.size
+        hot = _parsed_responses.values()
+
+    refreshed = 0
+    _refreshing.active = True
+    try:
+        for parsed in hot:
+            try:
+                parsed.refresh()
+                refreshed += 1
+            except Exception:
+                # Kept as is, and retried next time.  The refresh runs in the background, nothing can be reported
+                pass
+    finally:
+        _refreshing.active = False
+    return refreshed
+
+
+class _CountingReader(object):
+    """file like wrapper that counts the bytes read through it"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def read(self, *size):
+        data = self.stream.read(*size)
+        self.count += len(data)
+        return data
+
+
+def _iterparse_stories(stream):
+    """yields a Story for each <story> element of a stories document read from a file like object.
+    Elements are dropped from the tree once they have been turned into a Story
+    """
+    root = None
+    depth = 0
+    for event, element in ET.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = element
+            depth += 1
         else:
-            return False
-    else:
-        return None
\ No newline at end of file
+            depth -= 1
+            if depth == 1 and element.tag == 'story':
+                yield Story.from_node(element)
+                root.clear()
+
+
+def _integer(element):
+    return int(element.text)
+
+
+def _boolean(element):
+    return element.text == 'true'
+
+
+def _array(element):
+    return element.text.split(',')
+
+
+def _notes(element):
+    return [Note.from_node(note_node) for note_node in element]
+
+
+def _tasks(element):
+    return [Task.from_node(task_node) for task_node in element]
+
+
+def _attachments(element):
+    return [Attachment.from_node(attachment_node) for attachment_node in element]
+
+
+# Decoding tables, mapping the child elements of each model's xml to an attribute and the converter for it,
+# as json_api.py does for json.  A converter of None takes the element's stripped text, the common case, which
+# is decoded inline rather than with a call.  Elements a response leaves out get the defaults
+STORY_DEFAULTS = {'story_id': '', 'project_id': '', 'name': '', 'description': '', 'owned_by': '',
+                  'story_type': '', 'estimate': None, 'state': '', 'url': '', 'labels': ''}
+PROJECT_DEFAULTS = {'project_id': '', 'name': '', 'point_scale': None}
+NOTE_DEFAULTS = {'note_id': '', 'text': '', 'author': ''}
+TASK_DEFAULTS = {'task_id': '', 'description': '', 'complete': None}
+ATTACHMENT_DEFAULTS = {'attachment_id': '', 'description': '', 'url': ''}
+
+STORY_ELEMENTS = {
+    'id': ('story_id', None),
+    'project_id': ('project_id', None),
+    'name': ('name', None),
+    'description': ('description', None),
+    'owned_by': ('owned_by', None),
+    'story_type': ('story_type', None),
+    'estimate': ('estimate', _integer),
+    'current_state': ('state', None),
+    'url': ('url', None),
+    'labels': ('labels', None),
+    'notes': ('notes', _notes),
+    'attachments': ('attachments', _attachments),
+    'tasks': ('tasks', _tasks),
+}
+
+PROJECT_ELEMENTS = {
+    'id': ('project_id', None),
+    'name': ('name', None),
+    'point_scale': ('point_scale', _array),
+}
+
+NOTE_ELEMENTS = {
+    'id': ('note_id', None),
+    'text': ('text', None),
+    'author': ('author', None),
+}
+
+TASK_ELEMENTS = {
+    'id': ('task_id', None),
+    'description': ('description', None),
+    'complete': ('complete', _boolean),
+}
+
+ATTACHMENT_ELEMENTS = {
+    'id': ('attachment_id', None),
+    'text': ('description', None),
+    'url': ('url', None),
+}
+
+
+def _decode_element(node, elements, defaults):
+    """decodes an element in a single pass over its children, returns a dict of attribute -> value"""
+    values = dict(defaults)
+    for child in node:
+        decoder = elements.get(child.tag)
+        if decoder is not None:
+            attribute, convert = decoder
+            if convert is None:
+                text = child.text
+                values[attribute] = text.strip() if text is not None else ''
+            else:
+                values[attribute] = convert(child)
+    return values
@@ -0,0 +1,108 @@
+"""Buffered output for the list commands
+
+A Renderer collects lines and writes them to stdout in batches, so long listings cost a write per
+batch rather than a print per line.  A batch is written once it is full, or once FLUSH_INTERVAL has
+passed since the last write, so lines fed from a story iterator show up while later stories are
+still arriving.  The interval is only checked as lines come in, so call flush() before anything that
+waits on the network, such as requesting the next page.
+
+Output is only coloured when it goes to a terminal, piped output is plain text.
+"""
+
+# Core Imports
+import sys
+import time
+import struct
+import weakref
+
+# Lines written at once
+BATCH_SIZE = 200
+
+# Seconds a line may wait in the buffer for its batch to fill
+FLUSH_INTERVAL = 0.1
+
+# Streams are weakly held, so a long lived process writing to many does not keep them all
+_color_streams = weakref.WeakKeyDictionary()
+
+
+def use_color(stream=None):
+    """whether text written to the stream (default stdout) should be coloured, only terminals are"""
+    stream = stream or sys.stdout
+    if stream not in _color_streams:
+        isatty = getattr(stream, 'isatty', None)
+        _color_streams[stream] = bool(isatty and isatty())
+    return _color_streams[stream]
+
+
+def terminal_size(stream=None):
+    """the (rows, columns) of the terminal the stream (default stdout) writes to, or None if it is not one,
+    or its size cannot be read (as on Windows).
+    A stream standing in for a terminal, as the daemon's does, gives its size as a terminal_size attribute
+    """
+    stream = stream or sys.stdout
+    size = getattr(stream, 'terminal_size', None)
+    if size is not None:
+        return tuple(size)
+    try:
+        # Unix only, on Windows the size is left to the caller's default
+        import fcntl
+        import termios
+    except ImportError:
+        return None
+    try:
+        rows, cols = struct.unpack('hh', fcntl.ioctl(stream.fileno(), termios.TIOCGWINSZ, '\0' * 4))
+    except (AttributeError, IOError, ValueError):
+        return None
+    if rows <= 0 or cols <= 0:
+        return None
+    return rows, cols
+
+
+def colored(text, color=None, on_color=None, attrs=None, stream=None):
+    """termcolor.colored when writing to a terminal, the text unchanged otherwise"""
+    if not use_color(stream):
+        return text
+    from termcolor import colored
+    return colored(text, color, on_color, attrs)
+
+
+class Renderer(object):
+    """Writes lines to a stream (default stdout) in batches.  Use it as a context manager, or call
+    flush() when done, so the last batch is written
+
+        with Renderer() as out:
+            for story in stories:
+                out.line(story.name)
+    """
+
+    def __init__(self, stream=None, batch_size=BATCH_SIZE, interval=FLUSH_INTERVAL):
+        self.stream = stream or sys.stdout
+        self.batch_size = batch_size
+        self.interval = interval
+        self.encoding = getattr(self.stream, 'encoding', None) or 'utf-8'
+        self.lines = []
+        self.flushed_at = time.time()
+
+    def line(self, text=''):
+        if isinstance(text, unicode):
+            text = text.encode(self.encoding, 'replace')
+        self.lines.append(text)
+        if len(self.lines) >= self.batch_size or time.time() - self.flushed_at >= self.interval:
+            self.flush()
+
+    def bold(self, text):
+        self.line(colored(text, 'white', attrs=['bold'], stream=self.stream))
+
+    def flush(self):
+        if self.lines:
+            self.lines.append('')
+            self.stream.write('\n'.join(self.lines))
+            self.lines = []
+        self.stream.flush()
+        self.flushed_at = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
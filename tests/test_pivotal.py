@@ -0,0 +1,120 @@
+"""Tests for pivotal.py against benchmarks/fake_tracker.py
+
+    python -m unittest discover tests
+"""
+
+# Core Imports
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+from pivotal_tools import cache, pivotal
+from fake_tracker import FakeTracker
+
+
+class PivotalTestCase(unittest.TestCase):
+    """runs each test against a fake Tracker, with an empty cache directory and nothing held in memory"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tracker = FakeTracker(projects=2, stories=50)
+        cls.api_url = cls.tracker.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        pivotal.get_session().close()
+        cls.tracker.stop()
+
+    def setUp(self):
+        self.saved = dict((name, getattr(pivotal, name)) for name in
+                          ['API_URL', 'API_VERSION', 'TOKEN', 'RESPONSE_MAX_AGE', 'RESPONSE_CACHE_SIZE'])
+        self.saved_cache_dir = cache.CACHE_DIR
+        cache.CACHE_DIR = tempfile.mkdtemp()
+        pivotal.API_URL = self.api_url
+        pivotal.TOKEN = 'token'
+        self.reset()
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(pivotal, name, value)
+        shutil.rmtree(cache.CACHE_DIR)
+        cache.CACHE_DIR = self.saved_cache_dir
+        self.reset()
+
+    def reset(self):
+        pivotal.set_backend(None)
+        pivotal.Project.reset_cache(reload=True)
+        pivotal.refresh_responses(-1)
+
+
+class ProjectsCacheTest(PivotalTestCase):
+
+    def test_read_from_disk(self):
+        projects = pivotal.Project.all()
+        pivotal.Project.reset_cache(reload=True)
+        self.tracker.reset_stats()
+        self.assertEqual([p.project_id for p in pivotal.Project.all()], [p.project_id for p in projects])
+        self.assertEqual(self.tracker.stats()['requests'], 0)
+
+    def test_other_api_url_misses(self):
+        self.assertEqual(len(pivotal.Project.all()), 2)
+        pivotal.Project.reset_cache(reload=True)
+
+        other = FakeTracker(projects=3, stories=1)
+        pivotal.API_URL = other.start()
+        try:
+            self.assertEqual(len(pivotal.Project.all()), 3)
+            self.assertEqual(other.stats()['requests'], 1)
+        finally:
+            other.stop()
+
+
+class LoadProjectTest(PivotalTestCase):
+
+    def check_load_project(self):
+        project = pivotal.Project.load_project(2)
+        self.assertEqual((project.project_id, project.name, project.point_scale),
+                         ('2', 'Project 2', ['0', '1', '2', '3']))
+
+    def test_xml(self):
+        self.check_load_project()
+
+    def test_json(self):
+        pivotal.API_VERSION = '5'
+        pivotal.API_URL = self.tracker.v5_api_url
+        self.check_load_project()
+
+
+class ParsedResponsesTest(PivotalTestCase):
+
+    def query_distinct(self, project, rounds):
+        for n in range(rounds):
+            project.get_stories('state:started', limit=5, offset=n % 10)
+            project.get_stories('id:{}'.format(project.get_stories('', limit=1, offset=n)[0].story_id))
+
+    def test_not_kept_without_max_age(self):
+        pivotal.RESPONSE_MAX_AGE = 0
+        self.query_distinct(pivotal.Project.all()[0], 20)
+        self.assertEqual(pivotal.response_count(), 0)
+
+    def test_kept_up_to_the_cache_size(self):
+        pivotal.RESPONSE_MAX_AGE = 60
+        project = pivotal.Project.all()[0]
+        project.get_stories('state:started', limit=5)
+        self.assertEqual(pivotal.response_count(), 1)
+
+        # Room for about three responses
+        pivotal.RESPONSE_CACHE_SIZE = pivotal._parsed_responses_size * 3
+        self.query_distinct(project, 20)
+        self.assertLessEqual(pivotal._parsed_responses_size, pivotal.RESPONSE_CACHE_SIZE)
+        # 40 distinct queries were made
+        self.assertLess(pivotal.response_count(), 20)
+        self.assertGreater(pivotal.response_count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()